@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+"""
+Local stand-in for the ENA browser/portal, Entrez efetch, NCBI Datasets and
+GBIF endpoints used by GenomeNoteKore, serving synthetic data.
+
+Every umbrella project is generated from its accession number, so no state is
+needed beyond the shape of the data:
+    PRJEB<n>                -> umbrella with --children child projects, taxid 1000000 + n
+    child k                 -> holds assembly k, if k < --assemblies
+    assembly k              -> ilSynth<n>.hap<1|2>.<version>, hap1/hap2 pairs over versions
+    sequence_reports        -> --sequences reports of which --chromosomes are assembled molecules
+    superseded assemblies   -> --superseded-rate of them have a newer .2 revision, ENA lists
+                               both .1 and .2 and revision_history returns both
+
+Responses are delayed by --latency-ms (+/- --jitter-ms) and fail with a 503
+at --error-rate. GET /_stats returns request counts by endpoint, /_reset clears them.
+"""
+
+SPECIAL_CHROMOSOMES = ["X", "Z", "W"]
+
+
+class MockUpstream:
+    def __init__(self, children=200, assemblies=4, sequences=100000, chromosomes=24,
+                 latency_ms=50, jitter_ms=10, error_rate=0.0, seed=0, superseded_rate=0.25):
+        self.children        = children
+        self.assemblies      = assemblies
+        self.sequences       = sequences
+        self.chromosomes     = chromosomes
+        self.latency_ms      = latency_ms
+        self.jitter_ms       = jitter_ms
+        self.error_rate      = error_rate
+        self.seed            = seed
+        self.superseded_rate = superseded_rate
+        self.random          = random.Random(seed)
+        self.counts          = {}
+        self.lock            = threading.Lock()
+        # Every assembly shares one set of sequence reports, generated once as it is large
+        self.sequence_body  = None
+
+    def count(self, endpoint):
+        with self.lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+    def delay(self):
+        with self.lock:
+            jitter = self.random.uniform(-self.jitter_ms, self.jitter_ms)
+            failed = self.random.random() < self.error_rate
+        time.sleep(max(self.latency_ms + jitter, 0) / 1000)
+        return failed
+
+    @staticmethod
+    def project_number(accession):
+        return int("".join(c for c in accession if c.isdigit()) or 0)
+
+    def child_accessions(self, number):
+        return [f"PRJEB{number * 10000 + k}" for k in range(self.children)]
+
+    def superseded(self, number, k):
+        """
+        Whether assembly k of project number has a newer revision, decided by
+        the seed alone so every request agrees whatever order they arrive in
+        """
+        return random.Random(f"{self.seed}:{number}:{k}").random() < self.superseded_rate
+
+    def assemblies_of(self, child):
+        """
+        The assembly entries ENA lists for a child project, one per revision
+        for superseded assemblies, empty for children without an assembly
+        """
+        number, k = divmod(self.project_number(child), 10000)
+        if k >= self.assemblies:
+            return []
+        return [
+            {
+                "accession": f"GCA_{number:06d}{k:03d}",
+                "assembly_name": self.assembly_name(number, k),
+                "assembly_set_accession": f"GCA_{number:06d}{k:03d}.{revision}",
+                "tax_id": str(1000000 + number),
+            }
+            for revision in ([1, 2] if self.superseded(number, k) else [1])
+        ]
+
+    def revision_history(self, accession):
+        number, k = int(accession[4:10]), int(accession[10:13])
+        base = accession.partition(".")[0]
+        return [
+            {"genbank_accession": f"{base}.{revision}", "assembly_name": self.assembly_name(number, k), "release_date": date}
+            for revision, date in ([(1, "2024-01-01"), (2, "2025-01-01")] if self.superseded(number, k) else [(1, "2025-01-01")])
+        ]
+
+    @staticmethod
+    def assembly_name(number, k):
+        version, hap = divmod(k, 2)
+        return f"ilSynth{number}.hap{hap + 1}.{version + 1}"
+
+    def project_xml(self, accession):
+        number = self.project_number(accession)
+        children = "".join(
+            f'<RELATED_PROJECT><CHILD_PROJECT accession="{child}"/></RELATED_PROJECT>'
+            for child in self.child_accessions(number)
+        )
+        return (
+            f'<PROJECT_SET><PROJECT accession="{accession}"><TITLE>Synthus species{number}</TITLE>'
+            f'<ORGANISM><TAXON_ID>{1000000 + number}</TAXON_ID></ORGANISM>'
+            f'<RELATED_PROJECTS>{children}</RELATED_PROJECTS></PROJECT></PROJECT_SET>'
+        )
+
+    def taxonomy_xml(self, taxid):
+        number = int(taxid) - 1000000
+        lineage = "".join(
+            f"<Taxon><ScientificName>{name}</ScientificName><Rank>{rank}</Rank></Taxon>"
+            for name, rank in [("Eukaryota", "superkingdom"), ("Arthropoda", "phylum"), ("Insecta", "class"),
+                               ("Lepidoptera", "order"), ("Synthidae", "family"), ("Synthus", "genus")]
+        )
+        return (
+            f"<TaxaSet><Taxon><ScientificName>Synthus species{number}</ScientificName><Rank>species</Rank>"
+            f"<LineageEx>{lineage}</LineageEx></Taxon></TaxaSet>"
+        )
+
+    def dataset_report(self, accession):
+        number = int(accession[4:10])
+        return {"reports": [{
+            "assembly_info": {
+                "assembly_level": "Chromosome",
+                "biosample": {"attributes": [{"name": "tolid", "value": f"ilSynth{number}"}]},
+            },
+            "assembly_stats": {
+                "total_sequence_length": 450000000,
+                "number_of_contigs": self.sequences,
+                "contig_n50": 2500000,
+                "number_of_scaffolds": self.sequences,
+                "scaffold_n50": 16000000,
+                "total_number_of_chromosomes": self.chromosomes,
+                "genome_coverage": 40,
+            },
+            "wgs_info": {"wgs_project_accession": f"CA{number:06d}"},
+        }]}
+
+    def sequence_reports(self):
+        if self.sequence_body is None:
+            names = [str(i) for i in range(1, self.chromosomes - len(SPECIAL_CHROMOSOMES) + 1)] + SPECIAL_CHROMOSOMES
+            reports = [
+                {
+                    "genbank_accession": f"OX{i:06d}.1",
+                    "chr_name": names[i] if i < len(names) else "Un",
+                    "role": "assembled-molecule" if i < len(names) else "unplaced-scaffold",
+                    "length": 20000000 - i * 100 if i < len(names) else 5000,
+                    "gc_percent": 36.5,
+                }
+                for i in range(self.sequences)
+            ]
+            self.sequence_body = json.dumps({"reports": reports}).encode("utf-8")
+        return self.sequence_body
+
+    def route(self, path, query):
+        """
+        (endpoint, status, content_type, body) for a request
+        """
+        parts = path.strip("/").split("/")
+        if path.startswith("/ena/browser/xml/"):
+            return "ena_browser", 200, "application/xml", self.project_xml(parts[-1])
+        if path == "/ena/portal/search":
+            assemblies = self.assemblies_of(query.get("includeAccessions", [""])[0])
+            return "ena_portal", 200, "application/json", json.dumps(assemblies)
+        if path == "/entrez/efetch.fcgi":
+            return "entrez", 200, "application/xml", self.taxonomy_xml(query.get("id", ["1000000"])[0])
+        if path.startswith("/datasets/genome/accession/"):
+            accession, report = parts[-2], parts[-1]
+            if report == "revision_history":
+                revisions = self.revision_history(accession)
+                return "revision_history", 200, "application/json", json.dumps({"assembly_revisions": revisions})
+            if report == "dataset_report":
+                return "dataset_report", 200, "application/json", json.dumps(self.dataset_report(accession))
+            if report == "sequence_reports":
+                return "sequence_reports", 200, "application/json", self.sequence_reports()
+        if path == "/gbif/species/match":
+            return "gbif", 200, "application/json", json.dumps({"usageKey": 1000})
+        if path.startswith("/gbif/species/"):
+            return "gbif", 200, "application/json", json.dumps({"authorship": "(Mock, 2025)", "vernacularName": "Synthetic moth"})
+        return "unknown", 404, "application/json", json.dumps({"error": f"Unknown path {path}"})
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    upstream: MockUpstream
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/_stats":
+            return self.send(200, "application/json", json.dumps(self.upstream.counts))
+        if url.path == "/_reset":
+            with self.upstream.lock:
+                self.upstream.counts.clear()
+            return self.send(200, "application/json", "{}")
+
+        endpoint, status, content_type, body = self.upstream.route(url.path, parse_qs(url.query))
+        self.upstream.count(endpoint)
+        if self.upstream.delay():
+            return self.send(503, "application/json", json.dumps({"error": "Injected failure"}))
+        return self.send(status, content_type, body)
+
+    def send(self, status, content_type, body):
+        data = body if isinstance(body, bytes) else body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def upstream_urls(host, port):
+    """
+    The GNK_<NAME>_URL environmental values pointing GenomeNoteKore at the mock
+    """
+    base = f"http://{host}:{port}"
+    return {
+        "GNK_ENA_BROWSER_URL": f"{base}/ena/browser",
+        "GNK_ENA_PORTAL_URL": f"{base}/ena/portal",
+        "GNK_ENTREZ_URL": f"{base}/entrez",
+        "GNK_DATASETS_URL": f"{base}/datasets",
+        "GNK_GBIF_URL": f"{base}/gbif",
+    }
+
+
+def serve(upstream, host="127.0.0.1", port=0, ready=None):
+    handler = type("Handler", (MockHandler,), {"upstream": upstream})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    if ready is not None:
+        ready.put(server.server_port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(prog = "mock_upstream", description = "Synthetic ENA/NCBI/GBIF upstream")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8766)
+    parser.add_argument("--children", type = int, default = 200, help = "Child projects per umbrella project")
+    parser.add_argument("--assemblies", type = int, default = 4, help = "Assemblies per umbrella project (hap1/hap2 pairs)")
+    parser.add_argument("--sequences", type = int, default = 100000, help = "Sequence reports per assembly")
+    parser.add_argument("--chromosomes", type = int, default = 24, help = "Assembled molecules per assembly")
+    parser.add_argument("--latency-ms", type = float, default = 50)
+    parser.add_argument("--jitter-ms", type = float, default = 10)
+    parser.add_argument("--error-rate", type = float, default = 0.0)
+    parser.add_argument("--superseded-rate", type = float, default = 0.25, help = "Fraction of assemblies with a newer revision")
+    parser.add_argument("--seed", type = int, default = 0)
+    return parser.parse_args(argv)
+
+
+def upstream_from_args(args):
+    return MockUpstream(
+        args.children, args.assemblies, args.sequences, args.chromosomes,
+        args.latency_ms, args.jitter_ms, args.error_rate, args.seed, args.superseded_rate
+    )
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    for name, value in upstream_urls(args.host, args.port).items():
+        print(f"{name}={value}")
+    serve(upstream_from_args(args), args.host, args.port)
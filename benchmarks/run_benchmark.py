@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import resource
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+from benchmarks.mock_upstream import parse_args as mock_args, serve, upstream_from_args, upstream_urls  # noqa: E402
+from src.genomenotekore.bioproject import Bioproject  # noqa: E402
+from src.genomenotekore.cache import CACHES  # noqa: E402
+from src.genomenotekore.deadline import Deadline  # noqa: E402
+from src.genomenotekore.logs import log_context, setup_logging, stop_logging  # noqa: E402
+
+"""
+Scale benchmark for Bioproject -> Assembly -> Haplotype builds
+
+Starts the mock upstream in its own process, builds --projects synthetic
+umbrella projects against it and reports throughput, upstream requests per
+project, peak RSS and tail latency. With --baseline, exits non-zero if
+projects/sec or p95 latency regressed by more than --tolerance.
+
+    python benchmarks/run_benchmark.py --projects 20 --children 300 --sequences 100000
+"""
+
+logger = logging.getLogger("genomenotekore")
+
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(
+        prog = "run_benchmark",
+        description = "Benchmark GenomeNoteKore against a synthetic local upstream"
+    )
+    parser.add_argument("--projects", type = int, default = 10, help = "Synthetic umbrella projects to build")
+    parser.add_argument("--concurrency", type = int, default = 1, help = "Bioprojects built at once")
+    parser.add_argument("--children", type = int, default = 200, help = "Child projects per umbrella project")
+    parser.add_argument("--assemblies", type = int, default = 4, help = "Assemblies per umbrella project (hap1/hap2 pairs)")
+    parser.add_argument("--sequences", type = int, default = 100000, help = "Sequence reports per assembly")
+    parser.add_argument("--chromosomes", type = int, default = 24, help = "Assembled molecules per assembly")
+    parser.add_argument("--latency-ms", type = float, default = 50, help = "Mean upstream latency")
+    parser.add_argument("--jitter-ms", type = float, default = 10, help = "Upstream latency jitter")
+    parser.add_argument("--error-rate", type = float, default = 0.0, help = "Fraction of upstream requests answered with a 503")
+    parser.add_argument("--superseded-rate", type = float, default = 0.25, help = "Fraction of assemblies with a newer revision")
+    parser.add_argument("--project-timeout", type = float, default = None, help = "Budget for each Bioproject build")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--json", help = "Path to write the results to as JSON")
+    parser.add_argument("--baseline", help = "JSON results of a previous run to compare against")
+    parser.add_argument("--tolerance", type = float, default = 0.2, help = "Allowed fractional regression against --baseline")
+    return parser.parse_args(argv)
+
+
+def start_mock(args):
+    """
+    Run the mock upstream in a separate process so it doesn't share our GIL or RSS
+    """
+    upstream_args = mock_args([
+        "--children", str(args.children), "--assemblies", str(args.assemblies),
+        "--sequences", str(args.sequences), "--chromosomes", str(args.chromosomes),
+        "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+        "--error-rate", str(args.error_rate), "--superseded-rate", str(args.superseded_rate), "--seed", str(args.seed),
+    ])
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target = serve, args = (upstream_from_args(upstream_args), "127.0.0.1", 0, ready), daemon = True
+    )
+    process.start()
+    return process, ready.get(timeout = 30)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+def build(bioproject_id, project_timeout):
+    """
+    (seconds, complete, error) for one Bioproject build
+    """
+    start = time.perf_counter()
+    try:
+        with log_context(bioproject=bioproject_id):
+            bioproject = Bioproject(bioproject_id, "benchmark", Deadline(project_timeout))
+        return time.perf_counter() - start, bioproject.complete, None
+    except BaseException as e:
+        # Bioproject exits on upstream failures, count them rather than stopping the run
+        return time.perf_counter() - start, False, str(e) or e.__class__.__name__
+
+
+def run(args):
+    process, port = start_mock(args)
+    base = f"http://127.0.0.1:{port}"
+    os.environ.update(upstream_urls("127.0.0.1", port))
+    os.environ.setdefault("ENTREZ_EMAIL", "benchmark@example.com")
+
+    for cache in CACHES:
+        cache.clear()
+
+    bioproject_ids = [f"PRJEB{i}" for i in range(1, args.projects + 1)]
+    try:
+        requests.get(f"{base}/_reset")
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers = args.concurrency) as executor:
+            results = list(executor.map(lambda bioproject_id: build(bioproject_id, args.project_timeout), bioproject_ids))
+        elapsed = time.perf_counter() - start
+        upstream_counts = requests.get(f"{base}/_stats").json()
+    finally:
+        process.terminate()
+
+    latencies = [seconds for seconds, _, _ in results]
+    total_requests = sum(upstream_counts.values())
+    return {
+        "projects": args.projects,
+        "concurrency": args.concurrency,
+        "children": args.children,
+        "assemblies": args.assemblies,
+        "sequences": args.sequences,
+        "latency_ms": args.latency_ms,
+        "error_rate": args.error_rate,
+        "superseded_rate": args.superseded_rate,
+        "elapsed_s": round(elapsed, 3),
+        "projects_per_s": round(args.projects / elapsed, 3),
+        "requests_per_project": round(total_requests / args.projects, 1),
+        "requests_by_endpoint": upstream_counts,
+        "complete": sum(1 for _, complete, _ in results if complete),
+        "incomplete": sum(1 for _, complete, error in results if not complete and error is None),
+        "failed": sum(1 for _, _, error in results if error is not None),
+        "p50_s": round(percentile(latencies, 0.50), 3),
+        "p95_s": round(percentile(latencies, 0.95), 3),
+        "p99_s": round(percentile(latencies, 0.99), 3),
+        "max_s": round(max(latencies), 3),
+        # ru_maxrss is in KB on Linux and bytes on macOS
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 if sys.platform != "darwin" else 1024 ** 2), 1),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Regressions beyond tolerance against a previous run, as readable lines
+    """
+    regressions = []
+    if results["projects_per_s"] < baseline["projects_per_s"] * (1 - tolerance):
+        regressions.append(f"projects/sec {results['projects_per_s']} < baseline {baseline['projects_per_s']}")
+    if results["p95_s"] > baseline["p95_s"] * (1 + tolerance):
+        regressions.append(f"p95 {results['p95_s']}s > baseline {baseline['p95_s']}s")
+    if results["requests_per_project"] > baseline["requests_per_project"] * (1 + tolerance):
+        regressions.append(f"requests/project {results['requests_per_project']} > baseline {baseline['requests_per_project']}")
+    if results["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+        regressions.append(f"peak RSS {results['peak_rss_mb']}MB > baseline {baseline['peak_rss_mb']}MB")
+    return regressions
+
+
+def main(args):
+    listener = setup_logging(None, logging.WARNING)
+    try:
+        results = run(args)
+    finally:
+        stop_logging(listener)
+
+    for key, value in results.items():
+        print(f"{key:<22} {value}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main( parse_args() )
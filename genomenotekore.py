@@ -1,5 +1,8 @@
 #!/usr/bin/env python
 
+import os
+import sys
+import json
 import argparse
 import logging
 import textwrap
@@ -8,16 +11,14 @@ from dotenv import load_dotenv
 
 from src.genomenotekore.generics import file_to_list
 from src.genomenotekore.bioproject import Bioproject
+from src.genomenotekore.cache import set_cache_ttl
+from src.genomenotekore.deadline import Deadline
+from src.genomenotekore.logs import log_context, setup_logging, stop_logging
+from src.genomenotekore.render import Renderer, Template
+from src.genomenotekore.serve import BioprojectService, serve
+from src.genomenotekore.store import CHROMOSOME_COLUMNS, QUERY_COLUMNS, ResultStore
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.StreamHandler(),  # logs to terminal
-        logging.FileHandler("genomenotekore.log")  # logs to file
-    ]
-)
-logger = logging.getLogger('tcpserver')
+logger = logging.getLogger("genomenotekore")
 
 TIME = date.today()
 VERSION = "0.1.0"
@@ -38,44 +39,277 @@ DESCRIPTION = f"""
 """
 
 
+COMMANDS = ["run", "serve", "query"]
+
+
 def parse_args(argv = None):
+    argv = sys.argv[1:] if argv is None else argv
+    # `genomenotekore.py bioproject_file` is kept as shorthand for `run`
+    if argv and argv[0] not in COMMANDS + ["-h", "--help"]:
+        argv = ["run", *argv]
+
     parser = argparse.ArgumentParser(
         prog = "GenomeNoteKore",
         formatter_class=argparse.RawDescriptionHelpFormatter,
         description = textwrap.dedent(DESCRIPTION)
     )
 
-    parser.add_argument(
+    # Arguments shared by every command
+    common = argparse.ArgumentParser(add_help = False)
+
+    common.add_argument(
+        "-e", "--environmental_values",
+        help = "Path to a .env file containing credentials",
+        default = ".env"
+    )
+
+    common.add_argument(
+        "--log-file",
+        help = "Path to write JSON log records to, one per line",
+        default = "genomenotekore.log"
+    )
+
+    common.add_argument(
+        "--store",
+        help = "Path to the SQLite results store, written by run/serve and read by query",
+        default = "genomenotekore.db"
+    )
+
+    # Arguments shared by the commands which build Bioprojects
+    build = argparse.ArgumentParser(add_help = False)
+
+    build.add_argument(
+        "--project-timeout",
+        help = "Seconds allowed for each Bioproject build, once spent the partial result is emitted",
+        type = float,
+        default = None
+    )
+
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+
+    run = subparsers.add_parser(
+        "run",
+        parents = [common, build],
+        help = "Build each Bioproject in a file (the default command)"
+    )
+
+    run.add_argument(
         "bioproject_file",
         help = "Path to a txt file containing 1 bioproject ID per line."
     )
 
-    parser.add_argument(
+    run.add_argument(
         "-t", "--template_file",
-        help = "Path to the template Word Document",
-        default = "./template/template.docx",
-        type = argparse.FileType('r')
+        help = "Path to the template Word Document, a GenomeNote is rendered for each Bioproject when given",
+        default = None
     )
 
-    parser.add_argument(
-        "-e", "--environmental_values",
-        help = "Path to a .env file containing credentials",
-        default = ".env"
+    run.add_argument(
+        "-o", "--output-dir",
+        help = "Directory to write the rendered GenomeNote documents to",
+        default = "./output"
+    )
+
+    run.add_argument(
+        "--render-workers",
+        help = "Number of GenomeNote documents to write in parallel",
+        type = int,
+        default = 4
+    )
+
+    run.add_argument(
+        "--requeue-file",
+        help = "Path to write Bioprojects which hit --project-timeout to, in the bioproject_file format (removed when there are none)",
+        default = "requeue.txt"
+    )
+
+    serve = subparsers.add_parser(
+        "serve",
+        parents = [common, build],
+        help = "Serve Bioproject lookups over a local HTTP/JSON API with warm caches"
+    )
+
+    serve.add_argument(
+        "--host",
+        help = "Address to listen on",
+        default = "127.0.0.1"
+    )
+
+    serve.add_argument(
+        "--port",
+        help = "Port to listen on",
+        type = int,
+        default = 8765
+    )
+
+    serve.add_argument(
+        "--cache-ttl",
+        help = "Seconds a cached lookup (taxonomy, GBIF, assemblies, Bioproject results) is kept for",
+        type = float,
+        default = 3600
+    )
+
+    query = subparsers.add_parser(
+        "query",
+        parents = [common],
+        help = "Query the results store without re-fetching anything"
+    )
+
+    query.add_argument(
+        "--taxon",
+        help = "Name anywhere in the lineage (e.g. Lepidoptera) or the species"
+    )
+
+    query.add_argument("--taxid", help = "NCBI taxid")
+    query.add_argument("--tolid", help = "ToLID, e.g. ilKreTrap1")
+    query.add_argument("--accession", help = "Bioproject, assembly or WGS accession")
+
+    query.add_argument(
+        "--assembly-type",
+        help = "Assembly type",
+        choices = ["hap_asm", "prim_alt", "multiple_primaries", "UNKNOWN ASSEMBLY TYPE"]
+    )
+
+    query.add_argument("--assembly-level", help = "Assembly level, e.g. chromosome or scaffold")
+    query.add_argument("--min-scaffold-n50", help = "Scaffold N50 greater than, in Mb", type = float)
+    query.add_argument("--min-contig-n50", help = "Contig N50 greater than, in Mb", type = float)
+
+    query.add_argument(
+        "--complete",
+        help = "Only Bioprojects which were built without hitting --project-timeout",
+        action = "store_true"
+    )
+
+    query.add_argument(
+        "--chromosomes",
+        help = "Include the chromosome table of each matching assembly, as one TSV row per chromosome",
+        action = "store_true"
+    )
+
+    query.add_argument(
+        "--format",
+        help = "Output format",
+        choices = ["tsv", "json"],
+        default = "tsv"
     )
 
     return parser.parse_args(argv)
 
 
+def serve_bioprojects(args):
+    set_cache_ttl(args.cache_ttl)
+    store = ResultStore(args.store)
+    try:
+        serve(args.host, args.port, BioprojectService(args.project_timeout, args.cache_ttl, store))
+    finally:
+        store.close()
+
+
+def query_store(args):
+    if not os.path.exists(args.store):
+        sys.exit(f"No results store at {args.store}, run genomenotekore.py first")
+
+    store = ResultStore(args.store)
+    rows = store.query(
+        taxon = args.taxon,
+        taxid = args.taxid,
+        tolid = args.tolid,
+        accession = args.accession,
+        assembly_type = args.assembly_type,
+        assembly_level = args.assembly_level,
+        min_scaffold_n50_mb = args.min_scaffold_n50,
+        min_contig_n50_mb = args.min_contig_n50,
+        complete_only = args.complete
+    )
+    if args.chromosomes:
+        for row in rows:
+            row["chromosomes"] = store.chromosomes(row["hap_set_accession"])
+    store.close()
+
+    if args.format == "json":
+        print(json.dumps(rows, indent=2))
+        return
+
+    # With --chromosomes there is one row per chromosome, repeating the assembly columns
+    columns = QUERY_COLUMNS + (CHROMOSOME_COLUMNS if args.chromosomes else [])
+    print("\t".join(columns))
+    for row in rows:
+        for chromosome in row.pop("chromosomes", None) or [{}]:
+            values = {**row, **chromosome}
+            print("\t".join("" if values.get(c) is None else str(values[c]) for c in columns))
+
+
+def run_bioprojects(args):
+    bioproject_list = file_to_list(args.bioproject_file)
+
+    # The template is parsed once and shared by every document
+    renderer = None
+    if args.template_file:
+        renderer = Renderer(Template(args.template_file), args.output_dir, args.render_workers)
+
+    requeue = []
+    stored = 0
+    store = ResultStore(args.store)
+    try:
+        for bioproject_line in bioproject_list:
+            with log_context(bioproject=bioproject_line[0].strip()):
+                logger.info(f"Processing Bioproject: {bioproject_line}")
+                try:
+                    bioproject_data = Bioproject(
+                        bioproject_line[0].strip(),
+                        bioproject_line[1].strip(),
+                        Deadline(args.project_timeout)
+                    )
+                except (Exception, SystemExit) as e:
+                    # Bioproject exits on upstream failures, one bad project shouldn't end the batch
+                    logger.error(f"Failed to build Bioproject {bioproject_line[0].strip()}: {e}")
+                    requeue.append(bioproject_line)
+                    continue
+                if not bioproject_data.complete:
+                    logger.warning(f"Bioproject {bioproject_data.bioproject} is incomplete, missing: {bioproject_data.missing_stages()}")
+                    requeue.append(bioproject_line)
+
+                # Inside the log context so the render (and its log records) is tagged with the bioproject
+                print(bioproject_data)
+                store.save(bioproject_data)
+                stored += 1
+
+                if renderer is not None:
+                    renderer.submit(bioproject_data)
+
+        if renderer is not None:
+            failed = renderer.close()
+            logger.info(f"{len(renderer.futures) - len(failed)} GenomeNote(s) written to {args.output_dir}")
+    finally:
+        store.close()
+    logger.info(f"{stored} Bioproject(s) stored in {args.store}")
+
+    if requeue:
+        with open(args.requeue_file, "w") as file:
+            file.writelines(f"{bioproject_id}, {note}\n" for bioproject_id, note in requeue)
+        logger.info(f"{len(requeue)} Bioproject(s) written to {args.requeue_file} for requeueing")
+    elif os.path.exists(args.requeue_file):
+        # Left from an earlier run, everything in it has now been built
+        os.remove(args.requeue_file)
+        logger.info(f"Nothing to requeue, removed {args.requeue_file}")
+
+
 def main(args):
     # Load dotenv into environmental values
     # os.getenv() is used later on to get the value
     load_dotenv(args.environmental_values)
 
-    bioproject_list = file_to_list(args.bioproject_file)
-    for bioproject_line in bioproject_list:
-        logger.info(f"Processing Bioproject: {bioproject_line}")
-        bioproject_data = Bioproject(bioproject_line[0].strip(), bioproject_line[1].strip())
-        print(bioproject_data)
+    # Records are queued by the workers and written out by a background listener
+    listener = setup_logging(args.log_file)
+    try:
+        if args.command == "serve":
+            serve_bioprojects(args)
+        elif args.command == "query":
+            query_store(args)
+        else:
+            run_bioprojects(args)
+    finally:
+        stop_logging(listener)
 
 if __name__ == "__main__":
     main( parse_args() )
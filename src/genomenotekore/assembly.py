@@ -1,19 +1,30 @@
-import os
 import io
 import logging
-import requests
-import regex as re
+from concurrent.futures import ThreadPoolExecutor
 
-from .generics import find
+from .cache import ASSEMBLY_CACHE
+from .client import get, upstream
+from .deadline import Deadline, DeadlineExceeded
+from .generics import combine_haplotype_chr_tables, format_sex_chromosomes, get_sex_chromosomes
+from .assembly_index import AssemblyIndex
 from .haplotype import Haplotype
+from .logs import in_context
+from .revision import REVISION_RESOLVER
+from .scheduler import MAX_WORKERS
 
-logger = logging.getLogger("logger")
+logger = logging.getLogger("genomenotekore")
 
 class Assembly:
-    def __init__(self, taxid, children):
+    def __init__(self, taxid, children, deadline=None):
         self.taxid                              = taxid
         self.accessions                         = children
-        self.assembly_type, self.assembly_dict  = self.fetch_assembly_data()
+        self.deadline                           = deadline if deadline is not None else Deadline()
+        # Stages cut short by the --project-timeout budget or a failed upstream lookup
+        self.missing                            = []
+        # Every later stage looks assemblies up in the index rather than re-scanning them
+        self.index                              = AssemblyIndex(self.fetch_assembly_data())
+        self.assembly_type                      = self.index.assembly_types()
+        self.assembly_dict                      = self.index.assemblies
 
         self.assembly_data                      = self.process_assembly_data()
 
@@ -40,54 +51,35 @@ class Assembly:
         [
             txt.write(f"\t\t{a} = '{v}' \n")
             for a, v in self.collection
-            if a not in ["raw_xml","collection", "assembly_dict", "assembly_type"]
+            if a not in ["raw_xml","collection", "assembly_dict", "assembly_type", "deadline", "index"]
         ]
         txt.write("\t  )")
         return txt.getvalue()
 
-    def get_latest_revision(self, accession):
+    def to_dict(self):
+        return {
+            a: [haplotype.to_dict() for haplotype in v] if a == "assembly_data" else v
+            for a, v in self
+            if a not in ["collection", "assembly_dict", "deadline", "index"]
+        }
+
+    def missing_stages(self):
         """
-        Fetch the revision history for a given assembly accession and return the latest
-        accession and assembly name.
+        Stages missing from this Assembly and its Haplotypes, Haplotype stages
+        are prefixed with the assembly_set_accession they belong to.
         """
-        api_url = f"https://api.ncbi.nlm.nih.gov/datasets/v2/genome/accession/{accession}/revision_history?api_key={os.getenv('ENTREZ_API')}"
-
-        headers = {"Accept": "application/json"}
-        response = requests.get(api_url, headers=headers)
-
-        if response.status_code == 200:
-            try:
-                data = response.json()
-                # Check if there are assembly revisions
-                if "assembly_revisions" in data and data["assembly_revisions"]:
-                    # Sort revisions by release_date to get the latest one
-                    revisions = sorted(data["assembly_revisions"], key=lambda x: x["release_date"], reverse=True)
-                    latest_revision = revisions[0]
-                    latest_accession = latest_revision.get("genbank_accession", accession)
-                    latest_assembly_name = latest_revision.get("assembly_name", "Unknown assembly name")
-
-                    if latest_accession != accession:
-                        logger.info(f"Update found: {accession} -> {latest_accession} ({latest_assembly_name})")
-                    else:
-                        logger.info(f"No update needed for {accession} ({latest_assembly_name}).")
-
-                    return latest_accession, latest_assembly_name
-                else:
-                    logger.info(f"No revisions found for {accession}.")
-                    return accession, None
-            except ValueError:
-                logger.info("Error processing JSON response.")
-                return accession, None
-        else:
-            logger.info(f"Failed to fetch revision history, status code: {response.status_code}")
-            return accession, None
+        return self.missing + [
+            f"{haplotype.hap_set_accession}:{stage}"
+            for haplotype in self.assembly_data
+            for stage in haplotype.missing
+        ]
 
     def fetch_assembly_details(self, assembly_bioproject):
         """
-        Fetch specific assembly details for a given assembly BioProject and update
-        all relevant fields to the latest versions.
+        Fetch specific assembly details for a given assembly BioProject,
+        these are updated to their latest revision in fetch_assembly_data.
         """
-        url = "https://www.ebi.ac.uk/ena/portal/api/search"
+        url = f"{upstream('ena_portal')}/search"
         params = {
             'result': 'assembly',
             'includeAccessions': assembly_bioproject,
@@ -95,75 +87,69 @@ class Assembly:
             'limit': 40,
             'format': 'json'
         }
-        response = requests.get(url, params=params)
+        response = get(url, self.deadline, "assembly_dict", params=params)
 
         if response.status_code != 200:
-            logger.info(f"Failed to get data for project {assembly_bioproject}")
-            return []
+            logger.warning(f"Failed to get data for project {assembly_bioproject}")
+            return None
 
-        assemblies = response.json()
+        return response.json()
 
-        updated_assemblies = []
-        for assembly in assemblies:
+    def update_to_latest_revision(self, assembly_dicts):
+        """
+        Update every assembly to its latest revision in one pass, the revision
+        histories are looked up once per base accession for the whole run.
+        """
+        latest = REVISION_RESOLVER.resolve(
+            [assembly['assembly_set_accession'] for assembly in assembly_dicts if assembly.get('assembly_set_accession')],
+            self.deadline
+        )
+        for assembly in assembly_dicts:
             current_accession = assembly.get('assembly_set_accession')
             if current_accession:
-                latest_accession, latest_assembly_name = self.get_latest_revision(current_accession)
+                latest_accession, latest_assembly_name = latest[current_accession]
                 if latest_accession != current_accession:
                     assembly['assembly_set_accession'] = latest_accession
                 if latest_assembly_name:
                     assembly['assembly_name'] = latest_assembly_name
-            updated_assemblies.append(assembly)
 
-        return updated_assemblies
-
-    def determine_assembly_type(self, assembly_dicts):
-        """
-        If any assembly contains hap1 or hap2 in its name
-        """
-        results = {}
-
-        for assembly in assembly_dicts:
-            name = assembly['assembly_name']
-
-            hap_list = ["hap1","hap2"]
-            if  all(id in name for id in hap_list): # 'assembly_name': 'iyTipFemo hap1.1 / hap2.1'
-                results[name] = "multiple_primaries"
-            if any(id in name for id in hap_list):
-                results[name] = "hap_asm"
-            elif "alternate haplotype" in name: # 'assembly_name': 'iyTipFemo1.1 alternate haplotype'
-                results[name] = "prim_alt"
-            elif len(name.split(' ')) < 2: # 'assembly_name': 'iyTipFemo1.1'
-                results[name] = "prim_alt"
-            else:
-                results[name] = "UNKNOWN ASSEMBLY TYPE"
-        return results
-
-    def merge_assembly_dicts(self, types, assembly):
-        for i in assembly:
-            if i['assembly_name'] in types:
-                i['assembly_type'] = types[i['assembly_name']]
-            else:
-                logger.info(f"Why is {i['assembly_name']} not in {types}")
-
-        return assembly
+        return assembly_dicts
 
     def fetch_assembly_data(self):
         """
         Fetch and process assembly data for a BioProject, ensuring correct tax_id.
         """
         assembly_dicts = []
-        for bioproject in self.accessions:
-            for assembly in self.fetch_assembly_details(bioproject):
-                if assembly.get('tax_id') == self.taxid:
-                    assembly_dicts.append(assembly)
-
-        assembly_types = self.determine_assembly_type(assembly_dicts)
-        merged_dicts = self.merge_assembly_dicts(
-            self.determine_assembly_type(assembly_dicts),
-            assembly_dicts
-        )
-
-        return assembly_types, merged_dicts
+        try:
+            # Child projects are searched side by side, results are kept in child order
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                for cached_assemblies in executor.map(
+                    in_context(lambda bioproject: ASSEMBLY_CACHE.fetch(bioproject, lambda: self.fetch_assembly_details(bioproject))),
+                    self.accessions
+                ):
+                    if cached_assemblies is None:
+                        # A failed search, the assemblies of this child are unknown
+                        if "assembly_dict" not in self.missing:
+                            self.missing.append("assembly_dict")
+                        continue
+                    # Copied as the assembly dicts are updated with their assembly_type later on
+                    for assembly in [dict(i) for i in cached_assemblies]:
+                        if assembly.get('tax_id') == self.taxid:
+                            assembly_dicts.append(assembly)
+        except DeadlineExceeded:
+            # Keep the assemblies found so far, the rest of the children are unknown
+            logger.warning(f"Project timeout reached while fetching assemblies for taxid {self.taxid}")
+            if "assembly_dict" not in self.missing:
+                self.missing.append("assembly_dict")
+
+        try:
+            self.update_to_latest_revision(assembly_dicts)
+        except DeadlineExceeded:
+            # Assemblies are kept at the version ENA gave
+            logger.warning(f"Project timeout reached while resolving assembly revisions for taxid {self.taxid}")
+            self.missing.append("assembly_revisions")
+
+        return assembly_dicts
 
 
     # def extract_prim_alt_assemblies(self, assembly_dicts, tax_id):
@@ -232,61 +218,24 @@ class Assembly:
 
     def process_assembly_data(self):
         """
-        Process assembly types and get further assembly data
-        assembly_dict may contain multiple versions of the assembly in different assembly types
-        assembly_dict should be grouped by common value such as assembly version ilKreTrap1.hap1.1 and treated differently.
+        Build a Haplotype for every assembly, version group by version group
+        (ilKreTrap1.hap1.1 and ilKreTrap1.hap2.1 are ilKreTrap1 version 1) so
+        any number of versions and haplotypes are handled.
         """
-        assembly_types = [y for x, y in self.assembly_type.items()]
-        all_assemblies_same = all( i == assembly_types[0] for i in assembly_types)
-
-        assebmly_ordered_list = dict()
-        for individual_assembly in self.assembly_dict:
-            if all_assemblies_same & (assembly_types[0] == "hap_asm"):
-                # THIS NEEDS HARDENING - It'll kill stuff if there are > 2 hap_asms
-                if '1.0' not in assebmly_ordered_list:
-                    assebmly_ordered_list['1.0'] = [individual_assembly]
-                else:
-                    assebmly_ordered_list['1.0'].append(individual_assembly)
-            else:
-                get_tol_assem_version = re.search(r"\d+\.\d+", individual_assembly['assembly_name'])
-                tol_assem_version = get_tol_assem_version.group() # pyright: ignore
-                if tol_assem_version not in assebmly_ordered_list:
-                    assebmly_ordered_list[tol_assem_version] = [individual_assembly]
-                else:
-                    assebmly_ordered_list[tol_assem_version].append(individual_assembly)
-
-
-        haplotypes_list = []
-        for assembly_group in assebmly_ordered_list:
-            current_group = assebmly_ordered_list[assembly_group]
-
-            assembly_type_list = [i["assembly_type"] for i in current_group]
-            all_assemblies_same = all( i == assembly_type_list[0] for i in assembly_type_list)
+        haplotype_assemblies = []
+        for (tolid, version), group in self.index.version_groups():
+            assembly_types = {assembly["assembly_type"] for assembly in group}
+            if len(assembly_types) > 1 or "UNKNOWN ASSEMBLY TYPE" in assembly_types:
+                logger.info(f"This is an unknown assembly type for group:\n\t{tolid}.{version} {assembly_types}")
+            haplotype_assemblies.extend(group)
 
-            # TODO: YEAH WE CAN CONDENSE THIS
-            if all_assemblies_same & (len(assembly_type_list) > 0):
-                if assembly_type_list[0] == 'hap_asm':
-                    haplotypes_list.append(Haplotype(current_group[0]))
-                    haplotypes_list.append(Haplotype(current_group[1]))
+        # Each Haplotype only needs its own assembly, so they are built side by side
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            haplotypes = list(executor.map(in_context(lambda assembly: Haplotype(assembly, self.deadline)), haplotype_assemblies))
 
-                elif assembly_type_list[0] == 'prim_alt':
-                    haplotypes_list.append(Haplotype(current_group[0]))
-                    haplotypes_list.append(Haplotype(current_group[1]))
-
-                elif assembly_type_list[0] == 'multiple_primary':
-                    haplotypes_list.append(Haplotype(current_group[0]))
-                    haplotypes_list.append(Haplotype(current_group[1]))
-
-                else:
-                    logger.info(f"This is an unknown assembly type for group:\n\t{assembly_group}")
-                    haplotypes_list.append(Haplotype(current_group[0]))
-                    haplotypes_list.append(Haplotype(current_group[1]))
-
-            else:
-                haplotypes_list.append(Haplotype(current_group[0]))
-                haplotypes_list.append(Haplotype(current_group[1]))
-
-        return haplotypes_list
+        for assembly, haplotype in zip(haplotype_assemblies, haplotypes):
+            self.index.add_haplotype(assembly, haplotype)
+        return haplotypes
 
 
     def format_dict(self, input_dict):
@@ -299,59 +248,66 @@ class Assembly:
         compared to each other unlike in the original dict of dicts style the
         original script used.
 
-        So we move back into the Assembly space for the comparison
-        of:
-            - For each Haplotype (i in assembly_data)
-            - for each unique tolid, if the hap_value is not None and assembly_type is hap_asm
-                - Add data to a list for formatting
-
+        So we move back into the Assembly space for the comparison, using the
+        index to find the hap1 and hap2 of each tolid's latest version group,
+        keyed by role.
         """
-        dict = {}
-        for i in self.assembly_data:
-            if not i.tolid in dict and i.hap_value != None and i.assembly_type == "hap_asm":
-                dict[i.tolid] = [
-                    {
-                        "hap_value": i.hap_value,
-                        "assembly_type": i.assembly_type,
-                        "chr_table": i.chromosome_table,
-                        "assembly_level": i.assembly_level
-                    }
-                ]
-            elif i.tolid in dict and i.hap_value != None and i.assembly_type == "hap_asm":
-                dict[i.tolid].append(
-                    {
-                        "hap_value": i.hap_value,
-                        "assembly_type": i.assembly_type,
-                        "chr_table": i.chromosome_table,
-                        "assembly_level": i.assembly_level
-                    }
-                )
-            else:
-                pass
-
-        return dict
+        hap_tables = {}
+        for tolid, group in self.index.latest_version_groups().items():
+            haps = {}
+            for role in ["hap1", "hap2"]:
+                assembly = self.index.role_in_group(group, role)
+                haplotype = self.index.haplotype_for(assembly) if assembly is not None else None
+                if haplotype is None or haplotype.assembly_type != "hap_asm":
+                    continue
+                haps[role] = {
+                    "hap_value": haplotype.hap_value,
+                    "assembly_type": haplotype.assembly_type,
+                    "chr_table": haplotype.chromosome_table,
+                    "assembly_level": haplotype.assembly_level
+                }
+            if haps:
+                hap_tables[tolid] = haps
+
+        return hap_tables
 
     def organise_hap_chromosome_data(self):
-        for x, y in self.hap_assembly_chr_data.items():
-            hap1: dict = y[find(y, "hap_value", "hap1")]
-            hap2: dict = y[find(y, "hap_value", "hap2")]
+        """
+        Build the chromosome table for each hap_asm tolid:
+            - hap1 chromosome level, hap2 scaffold level -> hap1 table only
+            - both chromosome level -> hap1 and hap2 tables side by side
 
-            chr_data = []
-            if hap1["assembly_level"] == "chromosome" and hap2["assmembly_level"] == "scaffold":
+        A tolid whose chromosome tables are missing (e.g. cut short by the
+        project timeout) is left out rather than guessed at.
+        """
+        organised = {}
+        for tolid, haps in self.hap_assembly_chr_data.items():
+            if "hap1" not in haps or "hap2" not in haps:
+                logger.info(f"{tolid} does not have both hap1 and hap2, skipping combined chromosome table")
+                continue
+
+            hap1: dict = haps["hap1"]
+            hap2: dict = haps["hap2"]
+            if hap1["chr_table"] is None:
+                continue
+
+            if hap1["assembly_level"] == "chromosome" and hap2["assembly_level"] == "scaffold":
                 # get chromosome_data of hap1
                 chr_data = hap1["chr_table"]
-            elif hap1["assembly_level"] == "chromosome" and hap2["assmembly_level"] != "scaffold":
+                hap1_sex_chr = get_sex_chromosomes(chr_data)
+                hap2_sex_chr = []
+            elif hap1["assembly_level"] == "chromosome" and hap2["chr_table"] is not None:
                 # combine the chr_tables of the Haplotypes
                 chr_data = combine_haplotype_chr_tables(hap1["chr_table"], hap2["chr_table"])
+                hap1_sex_chr = get_sex_chromosomes(chr_data, "hap1_molecule")
+                hap2_sex_chr = get_sex_chromosomes(chr_data, "hap2_molecule")
+            else:
+                continue
 
-            #             hap1_sex_chromosomes = identify_sex_chromosomes(
-            #               chromosome_context.get('hap1_chromosome_data', [])
-            #               if 'hap1_chromosome_data' in chromosome_context
-            #               else [{'molecule': row['hap1_molecule']} for row in chromosome_context.get('chromosome_data', []) if row.get('hap1_molecule')]
-            # )
-            hap1_sex_chr = get_sex_chromosomes(chr_data)
-
+            organised[tolid] = {
+                "chromosome_table": chr_data,
+                "hap1_sex_chromosomes": format_sex_chromosomes(hap1_sex_chr) if hap1_sex_chr else None,
+                "hap2_sex_chromosomes": format_sex_chromosomes(hap2_sex_chr) if hap2_sex_chr else None,
+            }
 
-            hap2_sex_chr = get_sex_chromosomes(
-                [{'molecule': row['hap2_molecule']} for row in chr_data if row.get('hap2_molecule')]
-            ) if chr_data != []
+        return organised
@@ -0,0 +1,125 @@
+import regex as re
+
+"""
+Index of the assemblies found for a Bioproject
+
+Built in a single pass as assemblies are ingested, so later stages look up
+assemblies by accession, or by version group and haplotype role, rather
+than re-scanning names for every question.
+"""
+
+# ilKreTrap1.hap1.1, iyLasCalc2.1, iyLasCalc2.1 alternate haplotype
+ASSEMBLY_NAME = re.compile(r"^(?P<tolid>[A-Za-z]+\d+)\.(?:(?P<hap>hap\d)\.)?(?P<version>\d+)(?P<alternate> alternate haplotype)?")
+# Fallback for names such as 'iyTipFemo hap1.1 / hap2.1'
+VERSION = re.compile(r"(\d+)\.(\d+)")
+
+
+def determine_assembly_type(name):
+    """
+    hap_asm if the assembly contains hap1 or hap2 in its name
+    """
+    hap_list = ["hap1","hap2"]
+    if all(id in name for id in hap_list): # 'assembly_name': 'iyTipFemo hap1.1 / hap2.1'
+        return "multiple_primaries"
+    elif any(id in name for id in hap_list):
+        return "hap_asm"
+    elif "alternate haplotype" in name: # 'assembly_name': 'iyTipFemo1.1 alternate haplotype'
+        return "prim_alt"
+    elif len(name.split(' ')) < 2: # 'assembly_name': 'iyTipFemo1.1'
+        return "prim_alt"
+    else:
+        return "UNKNOWN ASSEMBLY TYPE"
+
+
+def parse_assembly_name(name):
+    """
+    Split an assembly name into (tolid, version, role), where role is one of
+    hap1, hap2, primary, alternate or multiple.
+    """
+    match = ASSEMBLY_NAME.search(name)
+    if match:
+        if match.group("hap"):
+            role = match.group("hap")
+        elif match.group("alternate"):
+            role = "alternate"
+        else:
+            role = "primary"
+        return match.group("tolid"), match.group("version"), role
+
+    version = VERSION.search(name)
+    return name.split(" ")[0], version.group(2) if version else "NA", "multiple"
+
+
+class AssemblyIndex:
+    def __init__(self, assembly_dicts=()):
+        self.assemblies     = []
+        self.by_accession   = {}
+        self.by_version     = {}
+        # Haplotypes once built, by the id() of their assembly dict as not
+        # every assembly has an assembly_set_accession
+        self.haplotypes     = {}
+
+        for assembly in assembly_dicts:
+            self.add(assembly)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(assemblies = '{len(self.assemblies)}', versions = '{list(self.by_version)}')"
+
+    def __len__(self):
+        return len(self.assemblies)
+
+    def add(self, assembly):
+        """
+        Classify and index one assembly dict, which gains assembly_type, tolid,
+        version and role keys. Assemblies already indexed (e.g. two versions
+        which resolved to the same latest revision) are skipped, assemblies
+        without an assembly_set_accession are always kept.
+        """
+        accession = assembly.get("assembly_set_accession")
+        if accession and accession in self.by_accession:
+            return self.by_accession[accession]
+
+        tolid, version, role = parse_assembly_name(assembly["assembly_name"])
+        assembly["assembly_type"] = determine_assembly_type(assembly["assembly_name"])
+        assembly["tolid"] = tolid
+        assembly["version"] = version
+        assembly["role"] = role
+
+        self.assemblies.append(assembly)
+        if accession:
+            self.by_accession[accession] = assembly
+        self.by_version.setdefault((tolid, version), []).append(assembly)
+        return assembly
+
+    def add_haplotype(self, assembly, haplotype):
+        self.haplotypes[id(assembly)] = haplotype
+
+    def assembly_types(self):
+        """
+        assembly_name -> assembly_type for every indexed assembly
+        """
+        return {assembly["assembly_name"]: assembly["assembly_type"] for assembly in self.assemblies}
+
+    def version_groups(self):
+        """
+        Assemblies grouped by tolid and version, oldest version first
+        """
+        return sorted(
+            self.by_version.items(),
+            key=lambda group: (group[0][0], int(group[0][1]) if group[0][1].isdigit() else -1)
+        )
+
+    def latest_version_groups(self):
+        """
+        The latest version group of each tolid, superseded versions are left out
+        """
+        return {tolid: group for (tolid, version), group in self.version_groups()}
+
+    def haplotype_for(self, assembly):
+        return self.haplotypes.get(id(assembly))
+
+    def role_in_group(self, group, role):
+        """
+        First assembly in a version group with the given role, None if there isn't one
+        """
+        return next((assembly for assembly in group if assembly["role"] == role), None)
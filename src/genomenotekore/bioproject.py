@@ -2,27 +2,47 @@ import os
 import io
 import sys
 import logging
-import requests
 # import tenacity # <-
 import xml.etree.ElementTree as ET
 
 from .assembly import Assembly
+from .cache import GBIF_CACHE, TAXONOMY_CACHE
+from .client import get, upstream
+from .deadline import Deadline, DeadlineExceeded
+from .logs import log_context
+from .scheduler import TaskGraph
 
-logger = logging.getLogger("logger")
+logger = logging.getLogger("genomenotekore")
 
 class Bioproject:
-    def __init__(self, bioproject_id, note):
+    def __init__(self, bioproject_id, note, deadline=None):
         self.bioproject                             = bioproject_id
         self.note                                   = note
-        self.raw_xml, self.study_title, self.taxid  = self.parse_xml_data()
-        self.child_accessions                       = self.Bioproject_get_child_accessions(self.raw_xml)
-        self.taxonomy_ranks                         = self.NCBI_get_taxonomy_lineage_and_ranks()
-        gbif_data                                   = self.GBIF_get_data()
-        self.taxonomic_authority                    = gbif_data["tax_auth"]
-        self.common_name                            = gbif_data["common_name"]
-        self.gbif_url                               = gbif_data["gbif_url"]
-        self.gbif_usage_key                         = gbif_data["gbif_usage_key"]
-        self.assembly_data                          = Assembly(self.taxid, self.child_accessions)
+        self.deadline                               = deadline if deadline is not None else Deadline()
+        # Stages cut short by the --project-timeout budget or a failed upstream lookup
+        self.missing                                = []
+
+        # Filled in by the build graph, set here to keep attribute order stable
+        self.raw_xml, self.study_title, self.taxid  = None, "NA", None
+        self.child_accessions                       = []
+        self.taxonomy_ranks                         = {}
+        self.taxonomic_authority                    = "NA"
+        self.common_name                            = "NA"
+        self.gbif_url                               = "NA"
+        self.gbif_usage_key                         = "NA"
+        self.assembly_data                          = None
+
+        # project_xml -> taxonomy_ranks -> gbif_data
+        #             -> assembly_data (-> Haplotypes)
+        build = TaskGraph(self.bioproject)
+        build.add("project_xml", self.set_project_xml)
+        build.add("taxonomy_ranks", self.set_taxonomy_ranks, ["project_xml"])
+        build.add("gbif_data", self.set_gbif_data, ["taxonomy_ranks"])
+        build.add("assembly_data", self.set_assembly_data, ["project_xml"])
+        with log_context(bioproject=self.bioproject):
+            build.run()
+
+        self.complete                               = self.missing_stages() == []
         self.collection = self.__iter__()
 
     def __iter__(self):
@@ -41,11 +61,66 @@ class Bioproject:
         [
             txt.write(f"\t{a} = '{v}' \n")
             for a, v in self.collection
-            if a not in ["raw_xml","collection"]
+            if a not in ["raw_xml","collection","deadline"]
         ]
         txt.write(")")
         return txt.getvalue()
 
+    def set_project_xml(self):
+        self.raw_xml, self.study_title, self.taxid  = self.run_stage(
+            "project_xml", self.parse_xml_data, (None, "NA", None)
+        )
+        self.child_accessions = self.Bioproject_get_child_accessions(self.raw_xml) if self.raw_xml is not None else []
+
+    def set_taxonomy_ranks(self):
+        self.taxonomy_ranks = self.run_stage(
+            "taxonomy_ranks", lambda: TAXONOMY_CACHE.fetch(self.taxid, self.NCBI_get_taxonomy_lineage_and_ranks), {}
+        ) or {}
+
+    def set_gbif_data(self):
+        gbif_data = self.run_stage(
+            "gbif_data", lambda: GBIF_CACHE.fetch(self.taxonomy_ranks.get("species"), self.GBIF_get_data), None
+        )
+        if gbif_data is not None:
+            self.taxonomic_authority    = gbif_data["tax_auth"]
+            self.common_name            = gbif_data["common_name"]
+            self.gbif_url               = gbif_data["gbif_url"]
+            self.gbif_usage_key         = gbif_data["gbif_usage_key"]
+
+    def set_assembly_data(self):
+        with log_context(stage="assembly_data"):
+            self.assembly_data = Assembly(self.taxid, self.child_accessions, self.deadline)
+
+    def to_dict(self):
+        """
+        Plain dict of the results, used for templating
+        """
+        return {
+            a: v.to_dict() if isinstance(v, Assembly) else v
+            for a, v in self
+            if a not in ["raw_xml","collection","deadline"]
+        }
+
+    def run_stage(self, stage, func, default):
+        """
+        Run one stage of the build, if the project budget runs out then the stage is
+        recorded in self.missing and `default` is returned so the build can carry on
+        and emit whatever has already been resolved.
+        """
+        with log_context(stage=stage):
+            try:
+                return func()
+            except DeadlineExceeded:
+                logger.warning(f"{self.bioproject}: project timeout reached, {stage} is missing")
+                self.missing.append(stage)
+                return default
+
+    def missing_stages(self):
+        """
+        All stages missing from this build, including those of the Assembly and its Haplotypes
+        """
+        return self.missing + self.assembly_data.missing_stages()
+
     def parse_xml_data(self):
         """
         Parses the study_title and tax_id for the umbrella bioproject from the fetched data.
@@ -60,10 +135,10 @@ class Bioproject:
         """
         Fetches data for a given umbrella BioProject.
         """
-        response = requests.get(f"https://www.ebi.ac.uk/ena/browser/api/xml/{self.bioproject}")
+        response = get(f"{upstream('ena_browser')}/xml/{self.bioproject}", self.deadline, "project_xml")
         if response.status_code != 200:
             sys.exit(f"Failed to get data for project {self.bioproject}")
-            logger.warn(f"Failed to get data for project {self.bioproject}")
+            logger.warning(f"Failed to get data for project {self.bioproject}")
             return None
 
         return ET.fromstring(response.text)
@@ -103,25 +178,30 @@ class Bioproject:
         """
         Fetch taxonomic classification and lineage from NCBI if available
         """
-        url = f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=taxonomy&id={self.taxid}&retmode=xml&api_key={os.getenv("ENTREZ_API")}"
+        url = f"{upstream('entrez')}/efetch.fcgi?db=taxonomy&id={self.taxid}&retmode=xml&api_key={os.getenv("ENTREZ_API")}"
         headers = {"User-Agent": f"Sanger ToL GenomeNote Script Suite; {os.getenv("ENTREZ_EMAIL")}"}
 
-        response = requests.get(url, headers=headers)
+        response = get(url, self.deadline, "taxonomy_ranks", headers=headers)
         if response.status_code == 200 and response.content:
             try:
                 return self.NCBI_parse_xml(response.content)
             except ET.ParseError as e:
-                print(f"Error parsing XML: {e}")
-                return {}
+                logger.error(f"Error parsing XML: {e}")
+                self.missing.append("taxonomy_ranks")
+                return None
         else:
             sys.exit(f"NCBI_get_taxonomy_lineage_and_ranks: Failed to fetch data for taxid {self.taxid}, status code: {response.status_code}\n Data = {response.content}")
-            logger.warn(f"NCBI_get_taxonomy_lineage_and_ranks: Failed to fetch data for taxid {self.taxid}, status code: {response.status_code}\n Data = {response.content}")
+            logger.warning(f"NCBI_get_taxonomy_lineage_and_ranks: Failed to fetch data for taxid {self.taxid}, status code: {response.status_code}\n Data = {response.content}")
             return {}
 
     def GBIF_get_data(self):
         """
-        Collect GBIF related data about taxonomy
+        Collect GBIF related data about taxonomy. A species without a GBIF match
+        gets the empty tax_dict, which is cached like any other answer. A failed
+        request returns None and is recorded as missing so the build is retried.
         """
+        self.deadline.check("gbif_data")
+
         tax_dict = {
             "tax_auth": "",
             "common_name": "",
@@ -131,27 +211,34 @@ class Bioproject:
 
         try:
             genus, specificEpithet = self.taxonomy_ranks["species"].split(" ")
-        except ValueError:
+        except (ValueError, KeyError, AttributeError):
             # TODO: Handle input that doesn't split into exactly two parts
             return tax_dict
 
-        initial_url = f"https://api.gbif.org/v1/species/match?specificEpithet={specificEpithet}&strict=true&genus={genus}"
+        initial_url = f"{upstream('gbif')}/species/match?specificEpithet={specificEpithet}&strict=true&genus={genus}"
 
-        response = requests.get(initial_url)
-        if response.status_code == 200:
-            match_data = response.json()
-            usage_key = match_data.get("usageKey")
+        response = get(initial_url, self.deadline, "gbif_data")
+        if response.status_code != 200:
+            logger.warning(f"GBIF_get_data: species match failed for {genus} {specificEpithet}, status code: {response.status_code}")
+            self.missing.append("gbif_data")
+            return None
 
-            if usage_key:
-                species_url = f"https://api.gbif.org/v1/species/{usage_key}"
-                species_response = requests.get(species_url)
+        usage_key = response.json().get("usageKey")
+        if not usage_key:
+            logger.info(f"GBIF_get_data: no GBIF match for {genus} {specificEpithet}")
+            return tax_dict
 
-                if species_response.status_code == 200:
-                    species_data = species_response.json()
+        species_url = f"{upstream('gbif')}/species/{usage_key}"
+        species_response = get(species_url, self.deadline, "gbif_data")
+        if species_response.status_code != 200:
+            logger.warning(f"GBIF_get_data: failed to fetch {species_url}, status code: {species_response.status_code}")
+            self.missing.append("gbif_data")
+            return None
 
-                    tax_dict["tax_auth"] = species_data.get("authorship", "").strip()
-                    tax_dict["common_name"] = species_data.get("vernacularName", "")
-                    tax_dict["gbif_url"] = species_url
-                    tax_dict["gbif_usage_key"] = usage_key
+        species_data = species_response.json()
+        tax_dict["tax_auth"] = species_data.get("authorship", "").strip()
+        tax_dict["common_name"] = species_data.get("vernacularName", "")
+        tax_dict["gbif_url"] = species_url
+        tax_dict["gbif_usage_key"] = usage_key
 
         return tax_dict
@@ -0,0 +1,83 @@
+import time
+import threading
+
+"""
+In-process caches kept warm between Bioproject builds
+
+Fetchers return None when a lookup fails, only other results are cached (an
+empty result is still an answer), so a fetch which fails or runs out of its
+Deadline is simply tried again next time.
+"""
+
+class TTLCache:
+    def __init__(self, name, ttl=3600):
+        self.name       = name
+        self.ttl        = ttl
+        self.entries    = {}
+        self.lock       = threading.Lock()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(name = '{self.name}', ttl = '{self.ttl}', entries = '{len(self.entries)}')"
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        The cached value for key, None if missing or older than the ttl
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self.entries[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+
+    def fetch(self, key, func):
+        """
+        Return the cached value for key, otherwise call func and cache what it returns
+        """
+        if key is None:
+            return func()
+
+        value = self.get(key)
+        if value is None:
+            value = func()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+# NCBI taxonomy lineage and ranks by taxid
+TAXONOMY_CACHE      = TTLCache("taxonomy")
+# GBIF authority and common name by species name
+GBIF_CACHE          = TTLCache("gbif")
+# ENA assembly search results by child bioproject accession
+ASSEMBLY_CACHE      = TTLCache("assembly")
+# NCBI datasets dataset_report and sequence_reports by assembly accession
+ASSEMBLY_INFO_CACHE = TTLCache("assembly_info")
+SEQUENCE_CACHE      = TTLCache("sequence_reports")
+# Latest revision by base assembly accession, kept briefly as new versions can be released at any time
+REVISION_CACHE      = TTLCache("revision_history", ttl=600)
+
+CACHES = [TAXONOMY_CACHE, GBIF_CACHE, ASSEMBLY_CACHE, ASSEMBLY_INFO_CACHE, SEQUENCE_CACHE, REVISION_CACHE]
+
+
+def set_cache_ttl(ttl):
+    """
+    Set the ttl of the long lived caches, REVISION_CACHE keeps its own short ttl
+    """
+    for cache in CACHES:
+        if cache is not REVISION_CACHE:
+            cache.ttl = ttl
@@ -0,0 +1,92 @@
+import os
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, ReadTimeoutError
+
+from .deadline import DeadlineExceeded
+
+"""
+HTTP helpers shared by Bioproject, Assembly and Haplotype
+"""
+
+# One Session for the whole process so connections to ENA/NCBI/GBIF are
+# pooled and reused, rather than a new TCP + TLS handshake per request
+POOL_SIZE = 16
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE))
+SESSION.mount("http://", HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE))
+
+# Response bodies are read in chunks of this many bytes, checking the Deadline between them
+CHUNK_SIZE = 64 * 1024
+
+# Base URL of each upstream, each can be pointed elsewhere (e.g. the benchmark
+# mock upstream) with a GNK_<NAME>_URL environmental value
+UPSTREAMS = {
+    "ena_browser":  "https://www.ebi.ac.uk/ena/browser/api",
+    "ena_portal":   "https://www.ebi.ac.uk/ena/portal/api",
+    "entrez":       "https://eutils.ncbi.nlm.nih.gov/entrez/eutils",
+    "datasets":     "https://api.ncbi.nlm.nih.gov/datasets/v2",
+    "gbif":         "https://api.gbif.org/v1",
+}
+
+
+def upstream(name):
+    """
+    Base URL for an upstream, read when called so a .env loaded after import still applies
+    """
+    return os.getenv(f"GNK_{name.upper()}_URL", UPSTREAMS[name])
+
+def is_timeout(error):
+    """
+    requests raises a timeout while reading the response body as a
+    ConnectionError wrapping urllib3's ReadTimeoutError, not as requests.Timeout
+    """
+    if isinstance(error, requests.Timeout):
+        return True
+    reasons = [*error.args, getattr(error.args[0], "reason", None) if error.args else None]
+    return any(isinstance(reason, (ReadTimeoutError, ConnectTimeoutError)) for reason in reasons)
+
+
+def get(url, deadline=None, stage=None, **kwargs):
+    """
+    requests.get which honours the Deadline of the current build.
+
+    requests applies a timeout to each socket operation (the connect and each
+    read) rather than the whole request, so the remaining budget is used as
+    that timeout and the body is streamed with the deadline checked between
+    chunks. A slow connect or a trickling body can then only overrun the
+    --project-timeout by one socket timeout. Running out of budget (before or
+    during the request) raises DeadlineExceeded naming the stage.
+    """
+    stage = stage or url
+    remaining = deadline.remaining() if deadline is not None else None
+    if remaining is None:
+        return SESSION.get(url, **kwargs)
+
+    # Read once, the budget could run out between two reads and requests rejects a timeout of 0
+    if remaining <= 0:
+        raise DeadlineExceeded(stage)
+    kwargs.setdefault("timeout", remaining)
+
+    try:
+        response = SESSION.get(url, stream=True, **kwargs)
+        try:
+            chunks = []
+            # read1 returns whatever has arrived, so the deadline is checked while a slow body trickles in
+            while chunk := response.raw.read1(CHUNK_SIZE, decode_content=True):
+                deadline.check(stage)
+                chunks.append(chunk)
+        except ReadTimeoutError as e:
+            response.close()
+            raise requests.ConnectionError(e) from e
+        except BaseException:
+            response.close()
+            raise
+        response.raw.release_conn()
+        # Callers get a response whose content has been read, as with requests.get
+        response._content = b"".join(chunks)
+        return response
+    except (requests.Timeout, requests.ConnectionError) as e:
+        if deadline.expired() and is_timeout(e):
+            raise DeadlineExceeded(stage) from e
+        raise
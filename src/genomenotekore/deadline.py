@@ -0,0 +1,41 @@
+import time
+
+"""
+Wall-clock budget shared by a single Bioproject build
+"""
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when a Bioproject build runs out of its --project-timeout budget.
+    The stage that was cut short is passed as the exception message.
+    """
+
+
+class Deadline:
+    def __init__(self, seconds=None):
+        """
+        A budget of `seconds` starting now, None means the budget never runs out.
+        """
+        self.seconds    = seconds
+        self.expires_at = time.monotonic() + seconds if seconds is not None else None
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(seconds={self.seconds}, remaining={self.remaining()})"
+
+    def remaining(self):
+        """
+        Seconds left in the budget, None if unlimited
+        """
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self):
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def check(self, stage):
+        """
+        Raise DeadlineExceeded before starting `stage` if the budget has gone
+        """
+        if self.expired():
+            raise DeadlineExceeded(stage)
@@ -29,6 +29,44 @@ def format_sex_chromosomes(sex_chromosomes):
     else:
         return ", ".join(sex_chromosomes[:-1]) + f", and {sex_chromosomes[-1]}"
 
+def get_sex_chromosomes(chromosome_report, key="molecule"):
+    """
+    Sorted list of the sex chromosomes found in a chromosome table,
+    `key` is the column holding the molecule name.
+    """
+    sex_chromosomes = set()
+    valid_sex_chromosomes = {'X', 'Y', 'Z', 'W', 'X1', 'X2', 'B'}
+
+    for chr_entry in chromosome_report:
+        chr_name = (chr_entry.get(key) or '').upper()  # Normalize to uppercase
+        if chr_name in valid_sex_chromosomes:
+            sex_chromosomes.add(chr_name)
+
+    return sorted(sex_chromosomes)
+
+def combine_haplotype_chr_tables(hap1_table, hap2_table):
+    """
+    Pair the chromosome tables of hap1 and hap2 by molecule name so they can
+    be shown side by side. Columns are prefixed with hap1_/hap2_ and molecules
+    only found in one haplotype have None for the other.
+    """
+    columns = ["INSDC", "molecule", "length", "GC"]
+    hap2_by_molecule = {row["molecule"]: row for row in hap2_table}
+
+    combined = []
+    for hap1_row in hap1_table:
+        hap2_row = hap2_by_molecule.pop(hap1_row["molecule"], {})
+        combined.append(
+            {f"hap1_{c}": hap1_row.get(c) for c in columns} | {f"hap2_{c}": hap2_row.get(c) for c in columns}
+        )
+
+    for hap2_row in hap2_by_molecule.values():
+        combined.append(
+            {f"hap1_{c}": None for c in columns} | {f"hap2_{c}": hap2_row.get(c) for c in columns}
+        )
+
+    return sorted(combined, key=lambda x: custom_sort_order(x["hap1_molecule"] or x["hap2_molecule"]))
+
 def custom_sort_order(molecule):
     special_order = {
         'X'     : (10000, 'X'),
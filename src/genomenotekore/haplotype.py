@@ -1,15 +1,22 @@
 import io
 import os
-import requests
 import logging
 
-from .generics import custom_sort_order, format_sex_chromosomes
+from .cache import ASSEMBLY_INFO_CACHE, SEQUENCE_CACHE
+from .client import get, upstream
+from .deadline import Deadline, DeadlineExceeded
+from .generics import custom_sort_order, format_sex_chromosomes, get_sex_chromosomes
+from .logs import log_context
 
 
-logger = logging.getLogger("logger")
+logger = logging.getLogger("genomenotekore")
 
 class Haplotype:
-    def __init__(self, assembly_type):
+    def __init__(self, assembly_type, deadline=None):
+        self.deadline                = deadline if deadline is not None else Deadline()
+        # Stages cut short by the --project-timeout budget or a failed upstream lookup
+        self.missing                 = []
+
         self.taxid                   = assembly_type["tax_id"]
         self.assembly_type           = assembly_type["assembly_type"]
         self.hap_name                = assembly_type["assembly_name"]
@@ -18,8 +25,10 @@ class Haplotype:
         self.hap_set_accession       = assembly_type["assembly_set_accession"]
 
         ### NCBI DATASET API CHUNK
-        ncbi_assembly_data           = self.NCBI_fetch_primary_assembly_info()
-        self.tolid                   = ncbi_assembly_data.get("tolid", "NA")                    # pyright: ignore
+        ncbi_assembly_data           = self.run_stage(
+            "assembly_info", lambda: ASSEMBLY_INFO_CACHE.fetch(self.hap_accession, self.NCBI_fetch_primary_assembly_info)
+        ) or {}
+        self.tolid                   = ncbi_assembly_data.get("tolid", assembly_type.get("tolid", "NA"))  # pyright: ignore
         self.assembly_level          = ncbi_assembly_data.get("assembly_level", "NA")           # pyright: ignore
         self.wgs_project_accession   = ncbi_assembly_data.get("wgs_project_accession", "NA")    # pyright: ignore
         self.raw_total_length        = int(ncbi_assembly_data.get("total_length", 0))           # pyright: ignore
@@ -41,12 +50,17 @@ class Haplotype:
         self.chromosome_count        = int(ncbi_assembly_data.get("chromosome_count", 0))               # pyright: ignore
         self.coverage                = int(ncbi_assembly_data.get("coverage", 0))                       # pyright: ignore
 
-        self.assembly_statistics     = self.NCBI_fetch_assembly_statistics()
-        self.longest_scaffold        = self.get_longest_scaffold(self.assembly_statistics) if self.assembly_statistics != None else None
+        self.assembly_statistics     = self.run_stage(
+            "assembly_statistics", lambda: SEQUENCE_CACHE.fetch(self.hap_accession, self.NCBI_fetch_assembly_statistics)
+        )
+        self.longest_scaffold        = self.get_longest_scaffold(self.assembly_statistics) if self.assembly_statistics else None
 
-        if assembly_type == "pri_alt":
+        if self.assembly_statistics is None:
+            # Without the sequence reports there is no chromosome table to build
+            self.chromosome_table    = None
+        elif self.assembly_type == "prim_alt":
             self.chromosome_table    = self.get_chromosome_table(self.assembly_statistics)
-        elif assembly_type == "hap_asm":
+        elif self.assembly_type == "hap_asm":
             # If chromosome scale then get chromosome_table
             # If not, then the Assembly Class will control it.
             self.chromosome_table    = self.get_chromosome_table(self.assembly_statistics) if self.assembly_level == "chromosome" else None
@@ -59,7 +73,7 @@ class Haplotype:
 
         # Turn off sex chromosome ID if assembly type is hap_asm
         self.sex_chromosomes         = self.get_sex_chromosomes(self.chromosome_table) if self.chromosome_table != None and self.assembly_type != "hap_asm" else None
-        self.formatted_sex_chr       = format_sex_chromosomes(self.sex_chromosomes) if self.sex_chromosomes != None else None
+        self.formatted_sex_chr       = format_sex_chromosomes(self.sex_chromosomes) if self.sex_chromosomes else None
 
 
         self.collection              = self.__iter__()
@@ -80,25 +94,42 @@ class Haplotype:
         [
             txt.write(f"\t\t\t{a} = '{v}' \n")
             for a, v in self.collection
-            if a not in ["raw_xml","collection"]
+            if a not in ["raw_xml","collection","deadline","assembly_statistics"]
         ]
         txt.write("\t\t  )")
         return txt.getvalue()
 
+    def to_dict(self):
+        return {a: v for a, v in self if a not in ["collection","deadline","assembly_statistics"]}
+
+    def run_stage(self, stage, func):
+        """
+        Run one stage of the Haplotype, returning None and recording the stage
+        in self.missing if the project budget runs out.
+        """
+        with log_context(accession=self.hap_set_accession, stage=stage):
+            try:
+                return func()
+            except DeadlineExceeded:
+                logger.warning(f"{self.hap_accession}: project timeout reached, {stage} is missing")
+                self.missing.append(stage)
+                return None
+
 
     def NCBI_fetch_primary_assembly_info(self):
         """
         Fetch data for the given accession and extract necessary fields including tolid and wgs_project_accession.
         """
-        api_url = f"https://api.ncbi.nlm.nih.gov/datasets/v2/genome/accession/{self.hap_accession}/dataset_report"
+        api_url = f"{upstream('datasets')}/genome/accession/{self.hap_accession}/dataset_report"
         headers = {
             'accept': 'application/json',
             'User-Agent': f'Python script; {os.environ["ENTREZ_EMAIL"]}'
         }
-        response = requests.get(api_url, headers=headers)
+        response = get(api_url, self.deadline, "assembly_info", headers=headers)
 
         if response.status_code != 200:
             logger.info(f"Failed to fetch data for {self.hap_accession}: HTTP {response.status_code}")
+            self.missing.append("assembly_info")
             return None
 
         data = response.json()
@@ -139,17 +170,18 @@ class Haplotype:
         """
         Fetch assembly stats from the NCBI API v2.
         """
-        api_url = f"https://api.ncbi.nlm.nih.gov/datasets/v2/genome/accession/{self.hap_accession}/sequence_reports"
+        api_url = f"{upstream('datasets')}/genome/accession/{self.hap_accession}/sequence_reports"
 
         headers = {
             'accept': 'application/json',
             'User-Agent': f'Python script; {os.environ["ENTREZ_EMAIL"]}'
         }
 
-        response = requests.get(api_url, headers=headers)
+        response = get(api_url, self.deadline, "assembly_statistics", headers=headers)
 
         if response.status_code != 200:
             logger.info(f"Failed to fetch data for {self.hap_accession}: HTTP {response.status_code}")
+            self.missing.append("assembly_statistics")
             return None
         data = response.json()
 
@@ -184,15 +216,7 @@ class Haplotype:
 
 
     def get_sex_chromosomes(self, chromosome_report):
-        sex_chromosomes = set()
-        valid_sex_chromosomes = {'X', 'Y', 'Z', 'W', 'X1', 'X2', 'B'}
-
-        for chr_entry in chromosome_report:
-            chr_name = chr_entry.get('molecule', '').upper()  # Normalize to uppercase
-            if chr_name in valid_sex_chromosomes:
-                sex_chromosomes.add(chr_name)
-
-        return sorted(sex_chromosomes)
+        return get_sex_chromosomes(chromosome_report)
 
 
     def fetch_chromosome_data(self):
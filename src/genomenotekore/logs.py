@@ -0,0 +1,173 @@
+import copy
+import json
+import time
+import queue
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+
+"""
+Non-blocking logging for GenomeNoteKore
+
+Workers only put records on a queue, a background listener does the terminal
+and file I/O. Every record is tagged with the bioproject, accession and stage
+it was logged under, and written to the log file as one JSON object per line.
+"""
+
+LOGGER_NAME = "genomenotekore"
+
+logger = logging.getLogger(LOGGER_NAME)
+
+BIOPROJECT  = contextvars.ContextVar("bioproject", default="-")
+ACCESSION   = contextvars.ContextVar("accession", default="-")
+STAGE       = contextvars.ContextVar("stage", default="-")
+CONTEXT     = {"bioproject": BIOPROJECT, "accession": ACCESSION, "stage": STAGE}
+
+
+@contextmanager
+def log_context(**values):
+    """
+    Tag every record logged within the block, e.g. log_context(bioproject="PRJEB79186")
+    """
+    tokens = [(CONTEXT[key], CONTEXT[key].set(value)) for key, value in values.items()]
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def in_context(func):
+    """
+    Wrap func so it runs with the log context of the caller, for work handed to a thread pool
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # Each call gets its own copy as a Context can only be entered by one thread at a time
+        return context.copy().run(func, *args, **kwargs)
+
+    return run
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        for key, var in CONTEXT.items():
+            setattr(record, key, var.get())
+        return True
+
+
+class ContextQueueHandler(QueueHandler):
+    def prepare(self, record):
+        """
+        QueueHandler.prepare folds the traceback into the message and clears
+        exc_info, so it is kept as record.exception for the formatters instead
+        """
+        record = copy.copy(record)
+        record.exception = None
+        if record.exc_info:
+            record.exception = logging.Formatter().formatException(record.exc_info)
+            record.exc_info, record.exc_text = None, None
+        return super().prepare(record)
+
+
+class TerminalFormatter(logging.Formatter):
+    def format(self, record):
+        line = super().format(record)
+        exception = getattr(record, "exception", None)
+        return f"{line}\n{exception}" if exception else line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "bioproject": getattr(record, "bioproject", "-"),
+            "accession": getattr(record, "accession", "-"),
+            "stage": getattr(record, "stage", "-"),
+            "thread": record.threadName,
+        }
+        if getattr(record, "exception", None):
+            entry["exception"] = record.exception
+        return json.dumps(entry)
+
+
+class RateLimitedSummary:
+    def __init__(self, message, interval=30, level=logging.INFO):
+        """
+        Count repetitive events and log one summary line at most every `interval`
+        seconds, `message` is formatted with the count e.g. "No update needed for {count} assemblies"
+        """
+        self.message    = message
+        self.interval   = interval
+        self.level      = level
+        self.count      = 0
+        self.last       = time.monotonic()
+        self.lock       = threading.Lock()
+
+    def add(self, n=1):
+        with self.lock:
+            self.count += n
+            if time.monotonic() - self.last < self.interval:
+                return
+            count, self.count, self.last = self.count, 0, time.monotonic()
+        logger.log(self.level, self.message.format(count=count))
+
+    def flush(self):
+        with self.lock:
+            count, self.count, self.last = self.count, 0, time.monotonic()
+        if count:
+            logger.log(self.level, self.message.format(count=count))
+
+
+SUMMARIES = []
+
+
+def summary(message, interval=30, level=logging.INFO):
+    """
+    Create a RateLimitedSummary which is flushed when logging stops
+    """
+    rate_limited = RateLimitedSummary(message, interval, level)
+    SUMMARIES.append(rate_limited)
+    return rate_limited
+
+
+def setup_logging(log_file="genomenotekore.log", level=logging.INFO):
+    """
+    Route the GenomeNoteKore logger through a queue. The terminal gets readable
+    lines and the log file JSON lines, both written by a background listener.
+    Returns the listener, pass it to stop_logging before exiting.
+    """
+    terminal = logging.StreamHandler()
+    terminal.setFormatter(TerminalFormatter("%(asctime)s [%(levelname)s] [%(bioproject)s %(accession)s %(stage)s] %(message)s"))
+
+    handlers = [terminal]
+    if log_file:
+        file = logging.FileHandler(log_file)
+        file.setFormatter(JsonFormatter())
+        handlers.append(file)
+
+    records = queue.SimpleQueue()
+    queue_handler = ContextQueueHandler(records)
+    queue_handler.addFilter(ContextFilter())
+
+    logger.handlers = [queue_handler]
+    logger.setLevel(level)
+    logger.propagate = False
+
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def stop_logging(listener):
+    """
+    Flush the summaries and wait for the listener to write everything queued
+    """
+    for rate_limited in SUMMARIES:
+        rate_limited.flush()
+    listener.stop()
@@ -0,0 +1,210 @@
+import io
+import os
+import logging
+import zipfile
+import regex as re
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
+
+from .logs import in_context
+
+"""
+Render GenomeNote Word documents from a .docx template
+
+The template is read and compiled once, then filled for each Bioproject.
+Placeholders are written in the document as {{ name }} where name is a dotted
+path into the context built by `build_context`, e.g.:
+    {{ study_title }}
+    {{ taxonomy_ranks.order }}
+    {{ primary.scaffold_N50_mb }}
+    {{ haplotypes.1.hap_name }}
+
+A table row holding a {{ chr.<column> }} placeholder is repeated once for each
+row of the chromosome table, e.g. {{ chr.molecule }}, {{ chr.length }} or
+{{ chr.hap2_molecule }} for combined hap_asm tables.
+
+A placeholder must sit within a single paragraph, Word may split it across
+runs and those run boundaries are removed when the template is compiled.
+"""
+
+logger = logging.getLogger("genomenotekore")
+
+# Placeholder prefix -> context key holding the list of rows to repeat over
+ROW_LOOPS = {"chr": "chromosome_table"}
+
+PLACEHOLDER = re.compile(r"\{\{((?:[^{}<]|<[^>]*>)*?)\}\}")
+TABLE_ROW = re.compile(r"<w:tr[ >](?:(?!</w:tr>).)*</w:tr>", re.DOTALL)
+XML_TAG = re.compile(r"<[^>]*>")
+
+
+def build_context(bioproject):
+    """
+    Template context for a Bioproject, its to_dict() plus shortcuts for the
+    parts of a GenomeNote that are otherwise deeply nested.
+    """
+    context = bioproject.to_dict()
+    assembly = context["assembly_data"]
+    haplotypes = assembly["assembly_data"]
+
+    # The primary assembly (or hap1) of the latest version leads the note, alternates never do.
+    # Taken from the same version group as the Assembly's combined chromosome tables.
+    index = bioproject.assembly_data.index
+    primary = {}
+    for group in index.latest_version_groups().values():
+        lead = index.role_in_group(group, "hap1") or index.role_in_group(group, "primary")
+        haplotype = index.haplotype_for(lead) if lead is not None else None
+        if haplotype is not None:
+            primary = haplotype.to_dict()
+            break
+    if not primary and haplotypes:
+        primary = haplotypes[0]
+
+    # Prefer the combined hap1/hap2 table where the Assembly built one
+    organised = assembly["organised_hap_data"].get(primary.get("tolid"), {})
+    chromosome_table = organised.get("chromosome_table") or primary.get("chromosome_table") or []
+
+    context.update({
+        "assembly": assembly,
+        "haplotypes": haplotypes,
+        "primary": primary,
+        "chromosome_table": chromosome_table,
+        "sex_chromosomes": organised.get("hap1_sex_chromosomes") or primary.get("formatted_sex_chr"),
+        "missing_stages": bioproject.missing_stages(),
+    })
+    return context
+
+
+def lookup(context, path):
+    """
+    Resolve a dotted path against nested dicts and lists, None if it isn't there
+    """
+    value = context
+    for key in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(key)
+        elif isinstance(value, list) and key.isdigit() and int(key) < len(value):
+            value = value[int(key)]
+        else:
+            return None
+    return value
+
+
+def format_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return ", ".join(format_value(i) for i in value)
+    return escape(str(value))
+
+
+class Template:
+    def __init__(self, template_path):
+        self.template_path  = template_path
+        self.parts          = self.load_template()
+        self.compiled       = {
+            name: self.compile_part(data.decode("utf-8"))
+            for name, (_, data) in self.parts.items()
+            if name.startswith("word/") and name.endswith(".xml") and b"{{" in data
+        }
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(template_path = '{self.template_path}', compiled = '{list(self.compiled)}')"
+
+    def load_template(self):
+        """
+        Read every member of the .docx (a zip archive) into memory once
+        """
+        with zipfile.ZipFile(self.template_path) as docx:
+            return {info.filename: (info, docx.read(info)) for info in docx.infolist()}
+
+    def compile_part(self, xml):
+        """
+        Compile one XML part into a list of literal strings, ("field", path)
+        and ("rows", source, body) items so rendering is just a join.
+        """
+        # Collapse run boundaries Word has put inside a placeholder
+        xml = PLACEHOLDER.sub(lambda m: "{{" + XML_TAG.sub("", m.group(1)).strip() + "}}", xml)
+
+        compiled = []
+        position = 0
+        for row in TABLE_ROW.finditer(xml):
+            loop = [prefix for prefix in ROW_LOOPS if "{{" + prefix + "." in row.group()]
+            if not loop:
+                continue
+            compiled.extend(self.compile_fields(xml[position:row.start()]))
+            compiled.append(("rows", loop[0], self.compile_fields(row.group())))
+            position = row.end()
+
+        compiled.extend(self.compile_fields(xml[position:]))
+        return compiled
+
+    def compile_fields(self, xml):
+        compiled = []
+        position = 0
+        for field in PLACEHOLDER.finditer(xml):
+            compiled.append(xml[position:field.start()])
+            compiled.append(("field", field.group(1).strip()))
+            position = field.end()
+        compiled.append(xml[position:])
+        return compiled
+
+    def fill(self, compiled, context):
+        txt = io.StringIO()
+        for item in compiled:
+            if isinstance(item, str):
+                txt.write(item)
+            elif item[0] == "field":
+                txt.write(format_value(lookup(context, item[1])))
+            else:
+                _, prefix, body = item
+                for row in context.get(ROW_LOOPS[prefix]) or []:
+                    txt.write(self.fill(body, {**context, prefix: row}))
+        return txt.getvalue()
+
+    def render(self, context):
+        """
+        Fill the template with a context and return the .docx as bytes
+        """
+        output = io.BytesIO()
+        with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as docx:
+            for name, (info, data) in self.parts.items():
+                if name in self.compiled:
+                    data = self.fill(self.compiled[name], context).encode("utf-8")
+                docx.writestr(info, data)
+        return output.getvalue()
+
+
+class Renderer:
+    def __init__(self, template, output_dir, workers=4):
+        """
+        Write GenomeNote documents in the background as Bioprojects are built
+        """
+        self.template   = template
+        self.output_dir = output_dir
+        self.executor   = ThreadPoolExecutor(max_workers=workers)
+        self.futures    = {}
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def submit(self, bioproject):
+        # Build the context now so the worker never touches the live classes
+        context = build_context(bioproject)
+        output_path = os.path.join(self.output_dir, f"{bioproject.bioproject}.docx")
+        self.futures[bioproject.bioproject] = self.executor.submit(in_context(self.write), context, output_path)
+
+    def write(self, context, output_path):
+        with open(output_path, "wb") as file:
+            file.write(self.template.render(context))
+        logger.info(f"GenomeNote written to {output_path}")
+        return output_path
+
+    def close(self):
+        """
+        Wait for the outstanding documents, returning the Bioprojects which failed
+        """
+        self.executor.shutdown(wait=True)
+        failed = []
+        for bioproject_id, future in self.futures.items():
+            if future.exception() is not None:
+                logger.error(f"Failed to render GenomeNote for {bioproject_id}: {future.exception()}")
+                failed.append(bioproject_id)
+        return failed
@@ -0,0 +1,124 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import REVISION_CACHE
+from .client import get, upstream
+from .logs import in_context, summary
+from .scheduler import MAX_WORKERS
+
+"""
+Resolve assembly accessions to their latest revision
+
+Every version of an assembly shares a base accession (GCA_963966685.1 and
+GCA_963966685.2 are both GCA_963966685) and a single revision_history, so
+lookups are made once per base accession rather than once per assembly.
+"""
+
+logger = logging.getLogger("genomenotekore")
+
+# Logged as periodic counts rather than a line per assembly
+NO_UPDATE_NEEDED    = summary("No update needed for {count} assemblies")
+NO_REVISIONS_FOUND  = summary("No revisions found for {count} assemblies")
+
+
+def split_accession(accession):
+    """
+    GCA_963966685.1 -> ("GCA_963966685", 1), the version is 0 when there isn't one
+    """
+    base, _, version = accession.partition(".")
+    return base, int(version) if version.isdigit() else 0
+
+
+class RevisionResolver:
+    def __init__(self, cache=REVISION_CACHE):
+        self.cache = cache
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(cache = '{self.cache}')"
+
+    def resolve(self, accessions, deadline=None):
+        """
+        Map each accession to (latest_accession, latest_assembly_name), the name
+        is None when no revision history could be found.
+
+        A base accession is fetched at most once, and not at all when a recent
+        answer is cached which is at least as new as the version asked about.
+        Histories that are needed are fetched side by side.
+        """
+        requested = {}
+        for accession in accessions:
+            base, version = split_accession(accession)
+            requested[base] = max(requested.get(base, 0), version)
+
+        latest = {}
+        to_fetch = []
+        for base, version in requested.items():
+            cached = self.cache.get(base)
+            if cached is not None and split_accession(cached[0])[1] >= version:
+                latest[base] = cached
+            else:
+                to_fetch.append(f"{base}.{version}" if version else base)
+
+        if to_fetch:
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                for accession, revision in zip(
+                    to_fetch, executor.map(in_context(lambda accession: self.fetch_revision_history(accession, deadline)), to_fetch)
+                ):
+                    base = split_accession(accession)[0]
+                    if revision is None:
+                        latest[base] = (accession, None)
+                    else:
+                        self.cache.set(base, revision)
+                        latest[base] = revision
+
+        resolved = {}
+        for accession in accessions:
+            latest_accession, latest_assembly_name = latest[split_accession(accession)[0]]
+            if latest_assembly_name is None:
+                resolved[accession] = (accession, None)
+                continue
+
+            resolved[accession] = (latest_accession, latest_assembly_name)
+            if latest_accession != accession:
+                logger.info(f"Update found: {accession} -> {latest_accession} ({latest_assembly_name})")
+            else:
+                NO_UPDATE_NEEDED.add()
+
+        return resolved
+
+    def fetch_revision_history(self, accession, deadline=None):
+        """
+        Fetch the revision history for a given assembly accession and return the latest
+        accession and assembly name, None if there isn't one.
+        """
+        api_url = f"{upstream('datasets')}/genome/accession/{accession}/revision_history?api_key={os.getenv('ENTREZ_API')}"
+
+        headers = {"Accept": "application/json"}
+        response = get(api_url, deadline, "assembly_revisions", headers=headers)
+
+        if response.status_code != 200:
+            logger.info(f"Failed to fetch revision history, status code: {response.status_code}")
+            return None
+
+        try:
+            data = response.json()
+        except ValueError:
+            logger.info("Error processing JSON response.")
+            return None
+
+        # Check if there are assembly revisions
+        if not data.get("assembly_revisions"):
+            NO_REVISIONS_FOUND.add()
+            return None
+
+        # Sort revisions by release_date to get the latest one
+        latest_revision = max(data["assembly_revisions"], key=lambda x: x["release_date"])
+        return (
+            latest_revision.get("genbank_accession", accession),
+            latest_revision.get("assembly_name", "Unknown assembly name")
+        )
+
+
+# Shared by every Bioproject in a run, so repeated bases are only looked up once
+REVISION_RESOLVER = RevisionResolver()
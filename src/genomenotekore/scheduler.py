@@ -0,0 +1,62 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .logs import in_context
+
+"""
+Small dependency-graph scheduler for the stages of a build
+
+Each task starts as soon as the tasks it depends on have finished, so
+independent branches run alongside each other and a build takes as long
+as its critical path rather than the sum of its stages.
+"""
+
+# Upper bound on the threads used to fan out within a single build
+MAX_WORKERS = 8
+
+
+class TaskGraph:
+    def __init__(self, name):
+        self.name       = name
+        self.tasks      = {}
+        self.results    = {}
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(name = '{self.name}', tasks = '{ {t: d for t, (_, d) in self.tasks.items()} }')"
+
+    def add(self, name, func, depends_on=()):
+        """
+        Add a task, `func` is called with no arguments once every task in
+        `depends_on` has finished.
+        """
+        unknown = [dependency for dependency in depends_on if dependency not in self.tasks]
+        if unknown:
+            raise ValueError(f"Task {name} depends on unknown task(s) {unknown} in {self.name}")
+        self.tasks[name] = (func, list(depends_on))
+
+    def run(self):
+        """
+        Run every task, returning their results by name. The first task to
+        raise cancels whatever hasn't started and the exception is re-raised.
+        """
+        pending = dict(self.tasks)
+        running = {}
+        with ThreadPoolExecutor(max_workers=min(len(self.tasks), MAX_WORKERS) or 1) as executor:
+            while pending or running:
+                ready = [
+                    name for name, (_, depends_on) in pending.items()
+                    if all(dependency in self.results for dependency in depends_on)
+                ]
+                for name in ready:
+                    func, _ = pending.pop(name)
+                    running[executor.submit(in_context(func))] = name
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        for other in running:
+                            other.cancel()
+                        raise future.exception()
+                    self.results[name] = future.result()
+
+        return self.results
@@ -0,0 +1,132 @@
+import json
+import logging
+import threading
+import regex as re
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from .bioproject import Bioproject
+from .cache import CACHES, TTLCache
+from .deadline import Deadline
+from .logs import log_context
+
+"""
+Long running service, keeping the HTTP pool and caches warm between lookups
+
+    GET /bioproject/<bioproject_id>[?note=...]  -> Bioproject.to_dict() as JSON
+    GET /health                                 -> cache sizes
+"""
+
+logger = logging.getLogger("genomenotekore")
+
+
+class BioprojectService:
+    def __init__(self, project_timeout=None, ttl=3600, store=None):
+        self.project_timeout    = project_timeout
+        # ResultStore every build is written to, if given
+        self.store              = store
+        self.results            = TTLCache("bioproject", ttl)
+        self.in_flight          = {}
+        self.lock               = threading.Lock()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(results = '{len(self.results)}', in_flight = '{list(self.in_flight)}')"
+
+    def lookup(self, bioproject_id, note="NA"):
+        """
+        Bioproject result for an accession. Concurrent lookups of the same
+        accession share a single build rather than each starting their own.
+        """
+        with self.lock:
+            result = self.results.get(bioproject_id)
+            if result is not None:
+                return result
+
+            future = self.in_flight.get(bioproject_id)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.in_flight[bioproject_id] = future
+
+        if owner:
+            try:
+                result = self.build(bioproject_id, note)
+                future.set_result(result)
+            except BaseException as e:
+                # Bioproject exits on upstream failures, which must not take the service down
+                future.set_exception(RuntimeError(str(e)) if isinstance(e, SystemExit) else e)
+            finally:
+                with self.lock:
+                    del self.in_flight[bioproject_id]
+
+        return future.result()
+
+    def build(self, bioproject_id, note):
+        with log_context(bioproject=bioproject_id):
+            logger.info(f"Building Bioproject: {bioproject_id}")
+            bioproject = Bioproject(bioproject_id, note, Deadline(self.project_timeout))
+        if self.store is not None:
+            self.store.save(bioproject)
+
+        result = bioproject.to_dict()
+        result["missing_stages"] = bioproject.missing_stages()
+
+        # Partial results are returned but not kept, the next lookup tries again
+        if bioproject.complete:
+            self.results.set(bioproject_id, result)
+        return result
+
+    def health(self):
+        return {cache.name: len(cache) for cache in [self.results, *CACHES]}
+
+
+class BioprojectHandler(BaseHTTPRequestHandler):
+    service: BioprojectService
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        route = url.path.strip("/").split("/")
+
+        if route == ["health"]:
+            return self.send_json(200, self.service.health())
+
+        if len(route) != 2 or route[0] != "bioproject":
+            return self.send_json(404, {"error": f"Unknown path {url.path}"})
+
+        bioproject_id = route[1]
+        if re.search(r"^PRJ[DEN][A-Z]\d+$", bioproject_id) is None:
+            return self.send_json(400, {"error": f"BIOPROJECT_ID {bioproject_id} DOESN'T MATCH THE REGEX: '^PRJ[DEN][A-Z]\\d+$'"})
+
+        note = parse_qs(url.query).get("note", ["NA"])[0]
+        try:
+            return self.send_json(200, self.service.lookup(bioproject_id, note))
+        except Exception as e:
+            logger.error(f"Failed to build {bioproject_id}: {e}")
+            return self.send_json(502, {"error": str(e)})
+
+    def send_json(self, status, body):
+        data = json.dumps(body, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} {format % args}")
+
+
+def serve(host, port, service):
+    """
+    Serve Bioproject lookups until interrupted
+    """
+    handler = type("Handler", (BioprojectHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    logger.info(f"Serving Bioproject lookups on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,235 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+"""
+Local SQLite store of everything a Bioproject build resolved
+
+Tables for projects, assemblies, haplotypes and chromosome rows, indexed by
+taxid, tolid and accession, so reports across many GenomeNotes are a local
+query rather than a re-run.
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    bioproject          TEXT PRIMARY KEY,
+    note                TEXT,
+    study_title         TEXT,
+    taxid               TEXT,
+    lineage             TEXT,
+    phylum              TEXT,
+    class               TEXT,
+    "order"             TEXT,
+    family              TEXT,
+    species             TEXT,
+    taxonomic_authority TEXT,
+    common_name         TEXT,
+    gbif_usage_key      TEXT,
+    complete            INTEGER,
+    missing             TEXT,
+    updated_at          TEXT
+);
+CREATE TABLE IF NOT EXISTS assemblies (
+    assembly_set_accession  TEXT PRIMARY KEY,
+    bioproject              TEXT REFERENCES projects(bioproject) ON DELETE CASCADE,
+    accession               TEXT,
+    assembly_name           TEXT,
+    taxid                   TEXT,
+    tolid                   TEXT,
+    version                 TEXT,
+    role                    TEXT,
+    assembly_type           TEXT
+);
+CREATE TABLE IF NOT EXISTS haplotypes (
+    hap_set_accession   TEXT PRIMARY KEY,
+    bioproject          TEXT REFERENCES projects(bioproject) ON DELETE CASCADE,
+    hap_accession       TEXT,
+    hap_name            TEXT,
+    hap_value           TEXT,
+    taxid               TEXT,
+    tolid               TEXT,
+    assembly_type       TEXT,
+    assembly_level      TEXT,
+    wgs_project_accession TEXT,
+    total_length        INTEGER,
+    contig_count        INTEGER,
+    scaffold_count      INTEGER,
+    contig_n50_mb       REAL,
+    scaffold_n50_mb     REAL,
+    genome_length_mb    REAL,
+    chromosome_count    INTEGER,
+    coverage            INTEGER,
+    longest_scaffold_mb REAL,
+    sex_chromosomes     TEXT,
+    missing             TEXT
+);
+CREATE TABLE IF NOT EXISTS chromosomes (
+    hap_set_accession   TEXT REFERENCES haplotypes(hap_set_accession) ON DELETE CASCADE,
+    bioproject          TEXT,
+    insdc               TEXT,
+    molecule            TEXT,
+    length_mb           REAL,
+    gc                  REAL
+);
+CREATE INDEX IF NOT EXISTS projects_taxid           ON projects(taxid);
+CREATE INDEX IF NOT EXISTS assemblies_bioproject    ON assemblies(bioproject);
+CREATE INDEX IF NOT EXISTS assemblies_taxid         ON assemblies(taxid);
+CREATE INDEX IF NOT EXISTS assemblies_tolid         ON assemblies(tolid);
+CREATE INDEX IF NOT EXISTS haplotypes_bioproject    ON haplotypes(bioproject);
+CREATE INDEX IF NOT EXISTS haplotypes_taxid         ON haplotypes(taxid);
+CREATE INDEX IF NOT EXISTS haplotypes_tolid         ON haplotypes(tolid);
+CREATE INDEX IF NOT EXISTS haplotypes_hap_accession ON haplotypes(hap_accession);
+CREATE INDEX IF NOT EXISTS haplotypes_type_level    ON haplotypes(assembly_type, assembly_level, scaffold_n50_mb);
+CREATE INDEX IF NOT EXISTS chromosomes_haplotype    ON chromosomes(hap_set_accession);
+CREATE INDEX IF NOT EXISTS chromosomes_insdc        ON chromosomes(insdc);
+"""
+
+# Columns returned by ResultStore.query
+QUERY_COLUMNS = [
+    "bioproject", "species", "taxid", "tolid", "hap_set_accession", "hap_name", "assembly_type",
+    "assembly_level", "scaffold_n50_mb", "contig_n50_mb", "genome_length_mb", "chromosome_count", "complete"
+]
+
+# Columns returned by ResultStore.chromosomes
+CHROMOSOME_COLUMNS = ["insdc", "molecule", "length_mb", "gc"]
+
+
+def to_number(value, cast=float):
+    """
+    Haplotype values are formatted for display ("1,234", "12.34"), turn them back into numbers
+    """
+    if value is None or value == "NA":
+        return None
+    try:
+        return cast(str(value).replace(",", ""))
+    except ValueError:
+        return None
+
+
+class ResultStore:
+    def __init__(self, path):
+        self.path       = path
+        self.lock       = threading.Lock()
+        # Shared between the render/serve threads, writes are serialised by the lock
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.executescript(SCHEMA)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(path = '{self.path}')"
+
+    def close(self):
+        self.connection.close()
+
+    def save(self, bioproject):
+        """
+        Write a Bioproject and everything under it, replacing any earlier build of it
+        """
+        project = bioproject.to_dict()
+        assembly = project["assembly_data"]
+        ranks = project["taxonomy_ranks"] or {}
+
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM projects WHERE bioproject = ?", (bioproject.bioproject,))
+            self.connection.execute(
+                """INSERT INTO projects VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    bioproject.bioproject, project["note"], project["study_title"], project["taxid"],
+                    ranks.get("lineage"), ranks.get("phylum"), ranks.get("class"), ranks.get("order"),
+                    ranks.get("family"), ranks.get("species"), project["taxonomic_authority"],
+                    project["common_name"], str(project["gbif_usage_key"]), int(bioproject.complete),
+                    json.dumps(bioproject.missing_stages()), datetime.now().isoformat(timespec="seconds"),
+                )
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO assemblies VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        i.get("assembly_set_accession"), bioproject.bioproject, i.get("accession"),
+                        i.get("assembly_name"), i.get("tax_id"), i.get("tolid"), i.get("version"),
+                        i.get("role"), i.get("assembly_type"),
+                    )
+                    for i in bioproject.assembly_data.assembly_dict
+                ]
+            )
+            for haplotype in assembly["assembly_data"]:
+                self.save_haplotype(bioproject.bioproject, haplotype)
+
+    def save_haplotype(self, bioproject_id, haplotype):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO haplotypes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                haplotype["hap_set_accession"], bioproject_id, haplotype["hap_accession"], haplotype["hap_name"],
+                haplotype["hap_value"], haplotype["taxid"], haplotype["tolid"], haplotype["assembly_type"],
+                haplotype["assembly_level"], haplotype["wgs_project_accession"], haplotype["raw_total_length"],
+                to_number(haplotype["contig_count"], int), to_number(haplotype["scaffold_count"], int),
+                to_number(haplotype["contig_N50_mb"]), to_number(haplotype["scaffold_N50_mb"]),
+                to_number(haplotype["genome_length_mb"]), haplotype["chromosome_count"], haplotype["coverage"],
+                haplotype["longest_scaffold"], haplotype["formatted_sex_chr"], json.dumps(haplotype["missing"]),
+            )
+        )
+        self.connection.execute("DELETE FROM chromosomes WHERE hap_set_accession = ?", (haplotype["hap_set_accession"],))
+        self.connection.executemany(
+            "INSERT INTO chromosomes VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (haplotype["hap_set_accession"], bioproject_id, row["INSDC"], row["molecule"], row["length"], row["GC"])
+                for row in haplotype["chromosome_table"] or []
+            ]
+        )
+
+    def query(self, taxon=None, taxid=None, tolid=None, accession=None, assembly_type=None,
+              assembly_level=None, min_scaffold_n50_mb=None, min_contig_n50_mb=None, complete_only=False):
+        """
+        Haplotypes (with their project) matching every filter given, e.g. all
+        chromosome level hap_asm assemblies in Lepidoptera with scaffold N50 > 10 Mb:
+            query(taxon="Lepidoptera", assembly_type="hap_asm", assembly_level="chromosome", min_scaffold_n50_mb=10)
+        """
+        filters, values = [], []
+        if taxon:
+            # Whole names only, Lepidoptera shouldn't match Lepidopteran
+            filters.append("(('; ' || p.lineage || '; ') LIKE ? OR p.species = ?)")
+            values.extend([f"%; {taxon}; %", taxon])
+        if taxid:
+            filters.append("h.taxid = ?")
+            values.append(str(taxid))
+        if tolid:
+            filters.append("h.tolid = ?")
+            values.append(tolid)
+        if accession:
+            filters.append("(h.hap_set_accession = ? OR h.hap_accession = ? OR h.bioproject = ? OR h.wgs_project_accession = ?)")
+            values.extend([accession] * 4)
+        if assembly_type:
+            filters.append("h.assembly_type = ?")
+            values.append(assembly_type)
+        if assembly_level:
+            filters.append("h.assembly_level = ?")
+            values.append(assembly_level.lower())
+        if min_scaffold_n50_mb is not None:
+            filters.append("h.scaffold_n50_mb > ?")
+            values.append(min_scaffold_n50_mb)
+        if min_contig_n50_mb is not None:
+            filters.append("h.contig_n50_mb > ?")
+            values.append(min_contig_n50_mb)
+        if complete_only:
+            filters.append("p.complete = 1")
+
+        columns = ", ".join(f"p.{c}" if c in ["species", "complete"] else f"h.{c}" for c in QUERY_COLUMNS)
+        sql = f"SELECT {columns} FROM haplotypes h JOIN projects p ON p.bioproject = h.bioproject"
+        if filters:
+            sql += " WHERE " + " AND ".join(filters)
+        sql += " ORDER BY h.bioproject, h.hap_name"
+
+        with self.lock:
+            return [dict(row) for row in self.connection.execute(sql, values)]
+
+    def chromosomes(self, hap_set_accession):
+        with self.lock:
+            return [
+                dict(row) for row in self.connection.execute(
+                    f"SELECT {', '.join(CHROMOSOME_COLUMNS)} FROM chromosomes WHERE hap_set_accession = ? ORDER BY rowid",
+                    (hap_set_accession,)
+                )
+            ]